@@ -0,0 +1,6 @@
+#!/bin/sh
+# RwStd requesting rarest first against the global block assignment (request_mode "assign").
+# Run from the repository root; the table is saved in bench/assign.txt.
+python rwrunner.py --mix rwstd.RwStd:24 --seed-class rwseed.RwSeed --seeds 10 --workers 1 \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 16, "max_up_bw": 64}' \
+    --state '{}' --state '{"RwStd": {"request_mode": "assign"}}' | grep -v "runs done"
@@ -0,0 +1,10 @@
+#!/bin/sh
+# RwStd with a fixed 4 upload slots against auto_slots, across upload bandwidths.
+# Run from the repository root; the table is saved in bench/auto_slots.txt.
+python rwrunner.py --mix rwstd.RwStd:24 --seed-class rwseed.RwSeed --seeds 10 --workers 1 \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 4, "max_up_bw": 8}' \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 8, "max_up_bw": 16}' \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 16, "max_up_bw": 32}' \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 32, "max_up_bw": 64}' \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 64, "max_up_bw": 128}' \
+    --state '{}' --state '{"RwStd": {"auto_slots": true}}' | grep -v "runs done"
@@ -0,0 +1,7 @@
+#!/bin/sh
+# RwStd without endgame against entering it with 16, 64 and 256 blocks left.
+# Run from the repository root; the table is saved in bench/endgame.txt.
+python rwrunner.py --mix rwstd.RwStd:24 --seed-class rwseed.RwSeed --seeds 10 --workers 1 \
+    --config '{"num_seeds": 4, "num_pieces": 64, "min_up_bw": 16, "max_up_bw": 64}' \
+    --state '{}' --state '{"RwStd": {"endgame_blocks": 16}}' --state '{"RwStd": {"endgame_blocks": 64}}' \
+    --state '{"RwStd": {"endgame_blocks": 256}}' | grep -v "runs done"
@@ -0,0 +1,5 @@
+#!/bin/sh
+# requests() of every client at 10k pieces, with the mean time of each phase; the goal
+# for request planning (the plan phase) is under 1 ms a round.
+# Run from the repository root; the output is saved in bench/plan.txt.
+python rwbench.py --peers 50 500 --pieces 10000 --history 2 --phases --out /dev/null | grep -A 1 "\.requests"
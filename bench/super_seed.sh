@@ -0,0 +1,9 @@
+#!/bin/sh
+# Each client seeding a swarm of its own kind with its own unchoker against
+# seed_mode "super" (SuperSeed's piece-sized slots), from one initial seed.
+# Run from the repository root; the table is saved in bench/super_seed.txt.
+for client in rwstd.RwStd rwpropshare.RwPropShare rwtyrant.RwTyrant rwtourney.RwTourney; do
+    python rwrunner.py --mix $client:20 --seed-class $client --seeds 20 --workers 1 \
+        --config '{"num_seeds": 1, "num_pieces": 64, "min_up_bw": 16, "max_up_bw": 64}' \
+        --seed-state '{}' --seed-state '{"seed_mode": "super"}' | grep -v "runs done"
+done
@@ -0,0 +1,9 @@
+#!/bin/sh
+# RwTyrant among RwStd peers, static against adaptive mode, with and without
+# the cap hill-climbing (cap_step 0 holds the cap at up_bw), from one and
+# from eight initial seeds.
+# Run from the repository root; the table is saved in bench/tyrant.txt.
+python rwrunner.py --mix rwstd.RwStd:15,rwtyrant.RwTyrant:5 --seeds 40 --workers 1 \
+    --config '{"num_pieces": 64}' --config '{"num_pieces": 64, "num_seeds": 8}' \
+    --state '{}' --state '{"RwTyrant": {"adaptive": true}}' \
+    --state '{"RwTyrant": {"adaptive": true, "cap_step": 0}}' | grep -v "runs done"
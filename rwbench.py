@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import random
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 has no tracemalloc, so peak memory is not reported
+    tracemalloc = None
+
+import rwprobe
+import rwsim
+
+CLIENTS = ["rwstd.RwStd", "rwpropshare.RwPropShare", "rwtyrant.RwTyrant", "rwtourney.RwTourney"]
+
+class Fixture(object):
+    """
+    Synthetic inputs for one client: a view of `num_peers` peers holding
+    random pieces, `len_history` rounds of downloads, and this round's
+    requests to the client. advance() moves everything on by one round the
+    way a swarm would, with a few peers gaining a piece.
+    """
+    def __init__(self, num_peers, num_pieces, len_history, seed=0, density=0.5, blocks_per_piece=16):
+        self.rng = random.Random(seed)
+        self.num_pieces = num_pieces
+        self.conf = rwsim.SimConfig(num_pieces=num_pieces, blocks_per_piece=blocks_per_piece)
+
+        self.peers = []
+        for i in range(num_peers):
+            pieces = [p for p in range(num_pieces) if self.rng.random() < density]
+            self.peers.append(rwsim.PeerInfo("peer%d" % i, pieces))
+        self.pieces = [self.rng.choice([0, 0, self.rng.randrange(blocks_per_piece), blocks_per_piece])
+                       for _ in range(num_pieces)]
+
+        self.history = rwsim.AgentHistory("me", [], [])
+        for _ in range(len_history):
+            self._add_round()
+
+    def client(self, cls):
+        return cls(self.conf, "me", self.pieces, self.conf.max_up_bw)
+
+    def advance(self):
+        for peer in self.rng.sample(self.peers, max(1, len(self.peers) // 100)):
+            missing = self.rng.randrange(self.num_pieces)
+            if missing not in peer.available_pieces:
+                peer.available_pieces = peer.available_pieces + [missing]
+        self._add_round()
+
+    def _add_round(self):
+        uploaders = self.rng.sample(self.peers, min(len(self.peers), 8))
+        self.history.downloads.append([
+            rwsim.Download(peer.id, "me", self.rng.randrange(self.num_pieces), self.rng.randint(1, 16))
+            for peer in uploaders])
+        self.history.uploads.append([])
+
+        requesters = self.rng.sample(self.peers, min(len(self.peers), 20))
+        self.requests = [rwsim.Request(peer.id, "me", self.rng.randrange(self.num_pieces), 0)
+                         for peer in requesters]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def bench(cls, method, num_peers, num_pieces, len_history, repeat, seed=0, phases=False):
+    """
+    cls -- client class
+    method -- "requests" or "uploads"
+    phases -- also run repeat probed calls and report each phase's mean time
+
+    returns: dict of per-call median, 99th percentile and max latency and
+    peak memory, and with phases, of phase name -> mean ms
+
+    Calls are timed in steady state: the client is warmed up on the fixture,
+    and before each timed call the fixture advances one round. The other
+    method still runs each round, untimed, so the client's state stays as it
+    would be in a swarm.
+    """
+    fixture = Fixture(num_peers, num_pieces, len_history, seed)
+    client = fixture.client(cls)
+    random.seed(seed)
+
+    # a round is requests() then uploads(), and only one of them is measured
+    def calls():
+        peers = list(fixture.peers)
+        f = lambda: client.requests(peers, fixture.history)
+        g = lambda: client.uploads(fixture.requests, list(fixture.peers), fixture.history)
+        return (f, g) if method == "requests" else (g, f)
+
+    measured, other = calls()
+    measured()
+    other()
+
+    times = []
+    for _ in range(repeat):
+        fixture.advance()
+        measured, other = calls()
+        if method == "uploads":
+            other()
+        times.append(timeit.timeit(measured, number=1) * 1000)
+        if method == "requests":
+            other()
+
+    phase_ms = None
+    if phases:
+        # a separate pass, so the probe's overhead stays out of the timings above
+        collector = rwprobe.Collector()
+        client.probe = rwprobe.Probe(collector, cls.__name__)
+        for _ in range(repeat):
+            fixture.advance()
+            measured, other = calls()
+            if method == "uploads":
+                other()
+            measured()
+            if method == "requests":
+                other()
+        client.probe = rwprobe.NULL_PROBE
+        phase_ms = dict((stack[2], 1000 * total / n) for stack, (n, total, _) in collector.phases.items()
+                        if len(stack) == 3 and stack[1] == method)
+
+    peak_kb = None
+    if tracemalloc is not None:
+        fixture.advance()
+        measured, other = calls()
+        if method == "uploads":
+            other()
+        tracemalloc.start()
+        measured()
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024.0
+        tracemalloc.stop()
+
+    return {
+        "client": cls.__name__,
+        "method": method,
+        "peers": num_peers,
+        "pieces": num_pieces,
+        "history": len_history,
+        "median_ms": percentile(times, 0.5),
+        "p99_ms": percentile(times, 0.99),
+        "max_ms": max(times),
+        "peak_kb": peak_kb,
+        "phase_ms": phase_ms,
+    }
+
+def compare(results, baseline, threshold):
+    """
+    returns: list of (result, baseline median) for results whose median
+    latency grew by more than threshold times the baseline's
+    """
+    key = lambda r: (r["client"], r["method"], r["peers"], r["pieces"], r["history"])
+    old = {key(r): r for r in baseline}
+    return [(r, old[key(r)]["median_ms"]) for r in results
+            if key(r) in old and r["median_ms"] > threshold * old[key(r)]["median_ms"]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time requests() and uploads() of each client.")
+    parser.add_argument("--clients", nargs="+", default=CLIENTS)
+    parser.add_argument("--peers", nargs="+", type=int, default=[50, 500, 2000])
+    parser.add_argument("--pieces", nargs="+", type=int, default=[500, 5000])
+    parser.add_argument("--history", nargs="+", type=int, default=[2, 20])
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="timed calls per case; below 200 the p99 is the slowest call")
+    parser.add_argument("--out", default="rwbench.json", help="where to save the results")
+    parser.add_argument("--baseline", help="earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument("--phases", action="store_true", help="also report the mean time of each probed phase")
+    args = parser.parse_args()
+
+    results = []
+    for path in args.clients:
+        cls = rwsim.load_client(path)
+        for num_peers in args.peers:
+            for num_pieces in args.pieces:
+                for len_history in args.history:
+                    for method in ("requests", "uploads"):
+                        r = bench(cls, method, num_peers, num_pieces, len_history, args.repeat, phases=args.phases)
+                        results.append(r)
+                        print("%s.%s %d peers / %d pieces / %d rounds: median %.2f ms, p99 %.2f ms, max %.2f ms, "
+                              "peak %s KB" % (
+                            r["client"], method, num_peers, num_pieces, len_history,
+                            r["median_ms"], r["p99_ms"], r["max_ms"], "-" if r["peak_kb"] is None else "%.0f" % r["peak_kb"]))
+                        if r["phase_ms"]:
+                            print("    " + ", ".join("%s %.2f ms" % (phase, ms) for phase, ms in sorted(r["phase_ms"].items())))
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r, old_median in regressions:
+            print("REGRESSION %s.%s %d/%d/%d: %.2f ms, was %.2f ms" % (
+                r["client"], r["method"], r["peers"], r["pieces"], r["history"], r["median_ms"], old_median))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+import binascii
+from itertools import compress, count
+from operator import ne
+
+def mask_of(pieces):
+    """
+    pieces -- iterable of piece indices
+
+    returns: an int bitset with bit i set for each piece i
+    """
+    pieces = list(pieces)
+    if not pieces:
+        return 0
+    buf = bytearray((max(pieces) >> 3) + 1)
+    for piece in pieces:
+        buf[piece >> 3] |= 1 << (piece & 7)
+    buf.reverse()
+    return int(binascii.hexlify(buf), 16)
+
+def bits(mask):
+    """
+    mask -- int bitset
+
+    returns: the indices of the set bits, lowest first
+    """
+    # walk the binary string least significant bit first, skipping '0b'
+    digits = bin(mask)[:1:-1]
+    i = digits.find("1")
+    while i != -1:
+        yield i
+        i = digits.find("1", i + 1)
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+class NeededMask(object):
+    """
+    The pieces a client still needs, cached across rounds: as an int bitset,
+    as a set and as an ascending list, with the blocks still missing from
+    them. Pieces only ever get completed, so each update only looks at the
+    entries of pieces that changed since the previous one, found by
+    comparing the old and new lists in C.
+    """
+    def __init__(self):
+        self.mask = None
+        self.needed = None
+        self.ascending = None
+        # blocks missing from the needed pieces
+        self.remaining = None
+        # pieces whose entry changed at the last update, all of them after a rebuild
+        self.changed = []
+        # blocks held of each piece at the last update
+        self.blocks = None
+
+    def update(self, pieces, blocks_per_piece):
+        """
+        pieces -- blocks held of each piece (a client's self.pieces)
+        blocks_per_piece -- blocks in a complete piece
+
+        returns: the bitset of pieces with fewer than blocks_per_piece blocks
+        """
+        if self.mask is None or len(pieces) != len(self.blocks):
+            self.ascending = [i for i, blocks in enumerate(pieces) if blocks < blocks_per_piece]
+            self.needed = set(self.ascending)
+            self.mask = mask_of(self.ascending)
+            self.remaining = sum(blocks_per_piece - pieces[i] for i in self.ascending)
+            self.changed = list(range(len(pieces)))
+        elif pieces != self.blocks:
+            self.changed = list(compress(count(), map(ne, pieces, self.blocks)))
+            completed = []
+            for i in self.changed:
+                if i in self.needed:
+                    blocks = min(pieces[i], blocks_per_piece)
+                    self.remaining -= blocks - self.blocks[i]
+                    if blocks == blocks_per_piece:
+                        completed.append(i)
+            if completed:
+                self.needed.difference_update(completed)
+                self.ascending = [i for i in self.ascending if i in self.needed]
+                self.mask ^= mask_of(completed)
+        else:
+            self.changed = []
+        self.blocks = list(pieces)
+        return self.mask
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+from messages import Upload, Request
+from peer import Peer
+from rwbits import NeededMask
+from rwplanner import Endgame, assign_blocks, rarest_first, rarest_first_penalized, upload_rates
+from rwprobe import probe
+from rwrarity import RarityIndex, WantedCounts
+from rwrng import client_rng
+from rwunchoke import SuperSeed
+
+class RarestFirst(object):
+    """
+    Piece selection: each peer is asked for its max_requests rarest pieces
+    that we need.
+    """
+    def plan(self, client, peers, needed_mask):
+        return rarest_first(peers, needed_mask, client.rarity, client.max_requests, client.rng,
+                            client.needed, client.wanted)
+
+class PenalizedRarestFirst(object):
+    """
+    Piece selection: rarest first, but a piece's rarity goes up by
+    state["request_count_factor"] each time it is requested this round, so
+    later peers are asked for other pieces.
+    """
+    def plan(self, client, peers, needed_mask):
+        factor = client.state["request_count_factor"]
+        return rarest_first_penalized(peers, needed_mask, client.rarity, client.max_requests, factor, client.rng,
+                                      client.needed, client.wanted)
+
+class Engine(Peer):
+    """
+    The round loop every client shares. requests() keeps the needed pieces,
+    the rarity view and the endgame up to date and plans with the client's
+    selector, unless request_mode or the endgame says otherwise; uploads()
+    asks the client's unchoker who gets how much bandwidth, or, once the
+    client has every piece and seed_mode is "super", the seeding one.
+
+    A client is a subclass that picks a selector (rwengine) and an unchoker
+    (rwunchoke) and adds their knobs to self.state.
+    """
+    def post_init(self):
+        self.rng = client_rng(self.conf, self.id)
+        self.probe = probe(self)
+        self.state = dict()
+        self.state["request_mode"] = "rarest"
+        self.state["endgame_blocks"] = 0
+
+        # "super" to upload in piece-sized slots (SuperSeed) once every piece is complete
+        self.state["seed_mode"] = None
+        # peers to seed to each round, None for one per piece of upload bandwidth
+        self.state["seed_slots"] = None
+
+        # rounds of history read back, the most any part below needs: last round's
+        # downloads, and RollingDownloads folds each round in as it arrives
+        self.history_window = 1
+
+        self.rarity = RarityIndex()
+        # RarityIndex over the whole swarm that a batched simulator shares, else None
+        self.swarm = None
+        self.needed = NeededMask()
+        self.endgame = Endgame()
+        # the needed pieces each peer has, for the selectors and for unchokers that weigh peers by them
+        self.wanted = WantedCounts()
+        # round the rarity view was last updated for
+        self.view_round = None
+
+        self.selector = RarestFirst()
+        self.unchoker = None
+        self.seed_unchoker = SuperSeed()
+
+    def requests(self, peers, history):
+        """
+        peers: available info about the peers (who has what pieces)
+        history: what's happened so far as far as this peer can see
+
+        returns: a list of Request() objects
+
+        This will be called after update_pieces() with the most recent state.
+        """
+        probe = self.probe
+        probe.start("requests")
+
+        # get pieces needed, as a bitset
+        needed_mask = self.needed.update(self.pieces, self.conf.blocks_per_piece)
+        probe.lap("needed")
+        if probe.on:
+            probe.size("needed_pieces", len(self.needed.needed))
+            probe.count("needed_cache_misses" if self.needed.changed else "needed_cache_hits")
+
+        # map pieces to rarity
+        self.update_view(peers, needed_mask, history)
+        probe.lap("rarity")
+        if probe.on:
+            # peers whose pieces were taken as unchanged, all of them when the view is shared
+            reused = len(peers) if self.rarity is self.swarm else self.rarity.reused
+            probe.count("view_cache_hits", reused)
+            probe.count("view_cache_misses", len(peers) - reused)
+
+        # account for last round's endgame requests and count the blocks left
+        wasted = self.endgame.wasted
+        remaining = self.endgame.update(self.pieces, needed_mask, self.conf.blocks_per_piece, history, self.needed)
+        probe.lap("endgame")
+        probe.count("endgame_wasted", self.endgame.wasted - wasted)
+
+        # make max number of requests to each peer, preference set by the selector
+        self.rng.shuffle(peers)
+        if 0 < remaining <= self.state["endgame_blocks"]:
+            # endgame, ask every peer that has them for the last blocks
+            rates = upload_rates(history)
+            duplicates = self.endgame.duplicates
+            plan = self.endgame.requests(peers, needed_mask, self.rarity, self.pieces, self.conf.blocks_per_piece, rates,
+                                         self.rng, self.needed)
+            probe.count("endgame_rounds")
+            probe.count("endgame_duplicates", self.endgame.duplicates - duplicates)
+        elif self.state["request_mode"] == "assign":
+            # spread distinct pieces over peers by expected bandwidth
+            rates = upload_rates(history)
+            plan = assign_blocks(peers, needed_mask, self.rarity, self.max_requests, self.pieces, self.conf.blocks_per_piece,
+                                 rates, self.rng, self.needed)
+        else:
+            plan = self.selector.plan(self, peers, needed_mask)
+        probe.lap("plan")
+
+        pieces = self.pieces
+        requests = [Request(self.id, peer_id, piece, pieces[piece]) for peer_id, piece in plan]
+        probe.lap("build")
+
+        probe.size("peers", len(peers))
+        probe.size("requests", len(requests))
+        probe.stop()
+        return requests
+
+    def uploads(self, requests, peers, history):
+        """
+        requests -- a list of the requests for this peer for this round
+        peers -- available info about all the peers
+        history -- history for all previous rounds
+
+        returns: list of Upload objects.
+
+        In each round, this will be called after requests().
+        """
+        probe = self.probe
+        probe.start("uploads")
+
+        if self.state["seed_mode"] == "super" and self.needed.mask == 0:
+            chosen, bws = self.seed_unchoker.unchoke(self, requests, peers, history)
+        else:
+            chosen, bws = self.unchoker.unchoke(self, requests, peers, history)
+
+        # create actual uploads out of the list of peer ids and bandwidths
+        uploads = [Upload(self.id, peer_id, bw) for (peer_id, bw) in zip(chosen, bws)]
+        probe.lap("build")
+
+        probe.size("requests", len(requests))
+        probe.size("chosen", len(uploads))
+        probe.stop()
+        return uploads
+
+    def share_view(self, swarm):
+        """
+        swarm -- RarityIndex over every peer, this one included, that the
+        simulator updates once a round before any client's requests()
+
+        For a client that sees every other peer: swarm becomes its rarity
+        index, so the simulator keeps one index instead of one per client.
+        The counts and holders of the pieces it needs are the same either
+        way, since it holds none of them; pieces it has count it as a holder.
+        """
+        self.swarm = swarm
+        self.rarity = swarm
+
+    def ensure_view(self, peers, history):
+        """
+        peers -- available info about the peers
+        history -- history for all previous rounds
+
+        For unchokers that read the rarity view: brings it up to this round
+        when requests() was skipped, as it is for a peer with nothing to ask.
+        """
+        if self.view_round != history.current_round():
+            self.probe.count("view_refreshes")
+            self.update_view(peers, self.needed.update(self.pieces, self.conf.blocks_per_piece), history)
+
+    def update_view(self, peers, needed_mask, history):
+        """
+        peers -- available info about the peers
+        needed_mask -- bitset of the pieces we still need
+        history -- history for all previous rounds
+
+        Updates the rarity index, unless it is the shared one, and self.wanted.
+        """
+        if self.rarity is not self.swarm:
+            self.rarity.update(peers)
+        self.wanted.update(self.rarity, needed_mask)
+        self.view_round = history.current_round()
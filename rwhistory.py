@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+class RollingDownloads(object):
+    """
+    Per-peer blocks downloaded over the last `window` rounds, discounted by
+    `discount` for each round of age, so the most recent round counts fully.
+    A window of None keeps every round, with exponential decay only.
+
+    Each round is folded in once, in O(downloads that round): the rounds in
+    the window sit in a ring buffer so the round leaving the window can be
+    subtracted, and aging is done by scaling one shared factor instead of
+    every peer's total.
+    """
+    # rescale stored totals before the shared factor overflows
+    max_boost = 1e150
+
+    def __init__(self, window, discount=1.0):
+        assert window is None or window > 0, "window must be positive"
+        assert 0 < discount <= 1, "discount must be in (0, 1]"
+        self.window = window
+        self.discount = discount
+
+        # next round of history to fold in
+        self.round = 0
+        # ring of (peer id -> blocks, boost) for the rounds in the window
+        self.ring = [None] * window if window else None
+        # peer id -> discounted blocks times self.boost
+        self.totals = dict()
+        # peer id -> rounds in the window with a download from that peer
+        self.present = dict()
+        # 1 / discount ** age of the most recent round, since the last rescale
+        self.boost = 1.0
+
+    def update(self, history):
+        """
+        history -- history for all previous rounds
+
+        Folds in the rounds completed since the last call.
+        """
+        round = history.current_round()
+        for r in range(self.round, round):
+            self._push(r, history.downloads[r])
+        self.round = max(self.round, round)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.present
+
+    def blocks(self, peer_id):
+        """
+        returns: discounted blocks downloaded from peer_id within the window
+        """
+        return self.totals.get(peer_id, 0) / self.boost
+
+    def items(self):
+        return [(peer_id, total / self.boost) for peer_id, total in self.totals.items()]
+
+    def _push(self, r, downloads):
+        blocks = dict()
+        for download in downloads:
+            blocks[download.from_id] = blocks.get(download.from_id, 0) + download.blocks
+
+        # age every total by one round
+        self.boost /= self.discount
+        if self.boost > self.max_boost:
+            self._rescale()
+
+        # drop the round leaving the window
+        if self.ring is not None:
+            slot = r % self.window
+            if self.ring[slot] is not None:
+                old_blocks, old_boost = self.ring[slot]
+                for peer_id, b in old_blocks.items():
+                    self.present[peer_id] -= 1
+                    if self.present[peer_id]:
+                        self.totals[peer_id] -= b * old_boost
+                    else:
+                        del self.present[peer_id]
+                        del self.totals[peer_id]
+            self.ring[slot] = (blocks, self.boost)
+
+        for peer_id, b in blocks.items():
+            self.present[peer_id] = self.present.get(peer_id, 0) + 1
+            self.totals[peer_id] = self.totals.get(peer_id, 0) + b * self.boost
+
+    def _rescale(self):
+        for peer_id in self.totals:
+            self.totals[peer_id] /= self.boost
+        if self.ring is not None:
+            self.ring = [entry and (entry[0], entry[1] / self.boost) for entry in self.ring]
+        self.boost = 1.0
@@ -0,0 +1,289 @@
+#!/usr/bin/python
+
+import heapq
+import random
+
+from rwbits import bits, popcount
+
+def candidates(peer_id, needed_mask, rarity, wanted=None):
+    """
+    returns: (bitset, number) of the needed pieces peer_id has, from wanted
+    if the caller keeps a WantedCounts
+    """
+    if wanted is not None:
+        return wanted.masks[peer_id], wanted.counts[peer_id]
+    mask = needed_mask & rarity.masks[peer_id]
+    return mask, popcount(mask)
+
+def rarest_first(peers, needed_mask, rarity, max_requests, rng=random, needed=None, wanted=None):
+    """
+    peers -- the peers to request from, in the order requests should be made
+    needed_mask -- bitset of the pieces we still need
+    rarity -- RarityIndex, already updated with peers
+    max_requests -- most pieces to request from any one peer
+    rng -- source of randomness for breaking ties
+    needed -- NeededMask at needed_mask, to reuse its set of pieces
+    wanted -- WantedCounts at needed_mask, to reuse each peer's needed pieces
+
+    returns: list of (peer id, piece) pairs, each peer's pieces rarest first
+
+    Pieces are ordered once per round, breaking ties randomly, and each peer
+    takes the first max_requests pieces of that order that it has. The order
+    is only worked out as far as the peers read it.
+    """
+    needed = needed.needed if needed is not None else set(bits(needed_mask))
+    order = rarity.ordered(rng, needed)
+
+    plan = []
+    for peer in peers:
+        has_needed, num_candidates = candidates(peer.id, needed_mask, rarity, wanted)
+        if not num_candidates:
+            continue
+
+        if max_requests * len(needed) < num_candidates * num_candidates:
+            # peer has most of what we need, so walking the order finds its pieces quickly
+            has = rarity.peer_pieces[peer.id]
+            chosen = []
+            for piece in order:
+                if piece in has:
+                    chosen.append(piece)
+                    if len(chosen) == max_requests:
+                        break
+        else:
+            # peer has few of the pieces we need, so rank just those
+            chosen = heapq.nsmallest(max_requests, bits(has_needed), key=order.key)
+
+        plan += [(peer.id, piece) for piece in chosen]
+
+    return plan
+
+def rarest_first_penalized(peers, needed_mask, rarity, max_requests, factor, rng=random, needed=None, wanted=None):
+    """
+    peers -- the peers to request from, in the order requests should be made
+    needed_mask -- bitset of the pieces we still need
+    rarity -- RarityIndex, already updated with peers
+    max_requests -- most pieces to request from any one peer
+    factor -- added to a piece's rarity each time it is requested
+    rng -- source of randomness for breaking ties
+    needed -- NeededMask at needed_mask, to reuse its list of pieces
+    wanted -- WantedCounts at needed_mask, to reuse each peer's needed pieces
+
+    returns: list of (peer id, piece) pairs, each peer's pieces in preference order
+
+    Like rarest_first(), but a piece gets less attractive to later peers each
+    time it is requested. Pieces live in a priority queue that takes in each
+    rarity's pieces only once the queue reaches it, and only the pieces just
+    requested are re-keyed.
+    """
+    needed = needed.needed if needed is not None else set(bits(needed_mask))
+    order = rarity.ordered(rng, needed)
+
+    # piece -> its current heap entry; entries not in here are stale
+    keys = dict()
+    heap = []
+    # pieces requested this round, whose entries went into the heap when re-keyed
+    requested = set()
+
+    def key(piece):
+        # a piece not requested yet is keyed by its place in the order
+        entry = keys.get(piece)
+        if entry is None:
+            entry = keys[piece] = order.key(piece) + (piece,)
+        return entry
+
+    # counts of the buckets not in the queue yet, rarest last
+    pending = order.pending
+
+    def fill():
+        # take in every bucket the queue has reached, so ties with re-keyed pieces are broken fairly
+        while pending and (not heap or heap[0][0] >= pending[-1]):
+            for piece in order.extend():
+                if piece not in requested:
+                    heapq.heappush(heap, key(piece))
+
+    plan = []
+    for peer in peers:
+        has_needed, num_candidates = candidates(peer.id, needed_mask, rarity, wanted)
+        if not num_candidates:
+            continue
+
+        if max_requests * len(needed) < num_candidates * num_candidates:
+            # peer has most of what we need, so pop from the queue until enough are found
+            has = rarity.peer_pieces[peer.id]
+            chosen = []
+            skipped = []
+            fill()
+            while heap and len(chosen) < max_requests:
+                entry = heapq.heappop(heap)
+                if keys[entry[2]] is entry:
+                    if entry[2] in has:
+                        chosen.append(entry[2])
+                    else:
+                        skipped.append(entry)
+                if pending and (not heap or heap[0][0] >= pending[-1]):
+                    fill()
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+        else:
+            # peer has few of the pieces we need, so rank just those
+            chosen = heapq.nsmallest(max_requests, bits(has_needed), key=key)
+
+        # re-key only the pieces just requested
+        for piece in chosen:
+            entry = (key(piece)[0] + factor, rng.random(), piece)
+            keys[piece] = entry
+            heapq.heappush(heap, entry)
+            requested.add(piece)
+            plan.append((peer.id, piece))
+
+    return plan
+
+def assign_blocks(peers, needed_mask, rarity, max_requests, pieces, blocks_per_piece, rates, rng=random, needed=None):
+    """
+    peers -- the peers to request from, in the order requests should be made
+    needed_mask -- bitset of the pieces we still need
+    rarity -- RarityIndex, already updated with peers
+    max_requests -- most pieces to request from any one peer
+    pieces -- blocks held of each piece (a client's self.pieces)
+    blocks_per_piece -- blocks in a complete piece
+    rates -- dict of peer id -> expected blocks per round from that peer
+    rng -- source of randomness for breaking ties
+    needed -- NeededMask at needed_mask, to reuse its set of pieces
+
+    returns: list of (peer id, piece) pairs
+
+    Treats the round's requests as one assignment of needed blocks to peers
+    instead of asking every peer for the same rarest pieces. Pieces are placed
+    rarest first, since they have the fewest holders to choose from, each with
+    the holder that has the most expected bandwidth left. Peers we have not
+    downloaded from yet are expected to match the best known rate. Spare slots
+    are then filled with duplicates, after each peer's distinct pieces, so a
+    peer that uploads more than expected is not left idle.
+    """
+    needed = needed.needed if needed is not None else set(bits(needed_mask))
+    order = rarity.ordered(rng, needed)
+
+    default_rate = max(rates.values()) if rates else blocks_per_piece
+    capacity = {peer.id: rates.get(peer.id, default_rate) for peer in peers}
+    slots = {peer.id: max_requests for peer in peers}
+    assigned = {peer.id: [] for peer in peers}
+    # ties go to the holder earliest in peers, not to whichever a set yields first
+    position = {peer.id: i for i, peer in enumerate(peers)}
+
+    # give each piece to the holder with the most bandwidth left
+    open_peers = len(peers)
+    for piece in order:
+        if not open_peers:
+            break
+        best = None
+        for peer_id in rarity.holders[piece]:
+            if slots[peer_id] and (best is None or capacity[peer_id] > capacity[best] or
+                                   capacity[peer_id] == capacity[best] and position[peer_id] < position[best]):
+                best = peer_id
+        if best is None:
+            continue
+
+        assigned[best].append(piece)
+        capacity[best] -= blocks_per_piece - pieces[piece]
+        slots[best] -= 1
+        if not slots[best]:
+            open_peers -= 1
+
+    # fill spare slots with duplicates, rarest first
+    for peer in peers:
+        if slots[peer.id]:
+            has = rarity.peer_pieces[peer.id]
+            mine = set(assigned[peer.id])
+            for piece in order:
+                if piece in has and piece not in mine:
+                    assigned[peer.id].append(piece)
+                    slots[peer.id] -= 1
+                    if not slots[peer.id]:
+                        break
+
+    return [(peer.id, piece) for peer in peers for piece in assigned[peer.id]]
+
+def upload_rates(history, rounds=1):
+    """
+    history -- history for all previous rounds
+    rounds -- how many of the most recent rounds to average over
+
+    returns: dict of peer id -> blocks per round that peer uploaded to us
+    """
+    round = history.current_round()
+    recent = history.downloads[max(0, round - rounds):round]
+
+    rates = dict()
+    for downloads in recent:
+        for download in downloads:
+            rates[download.from_id] = rates.get(download.from_id, 0) + download.blocks / float(len(recent))
+    return rates
+
+class Endgame(object):
+    """
+    A client's endgame: once only a few blocks are left, every remaining
+    piece is requested from every peer that has it, fastest peers first.
+    Blocks that arrive beyond what a piece still needed are counted as
+    wasted bandwidth.
+    """
+    def __init__(self):
+        # blocks downloaded beyond what endgame pieces needed
+        self.wasted = 0
+        # requests sent on top of one per remaining piece
+        self.duplicates = 0
+        # piece -> blocks it needed when last requested in endgame
+        self.requested = None
+
+    def update(self, pieces, needed_mask, blocks_per_piece, history, needed=None):
+        """
+        pieces -- blocks held of each piece (a client's self.pieces)
+        needed_mask -- bitset of the pieces we still need
+        blocks_per_piece -- blocks in a complete piece
+        history -- history for all previous rounds
+        needed -- NeededMask at needed_mask, to take the blocks still needed from
+
+        returns: number of blocks still needed
+
+        Counts the waste from last round's endgame requests, if any.
+        """
+        round = history.current_round()
+        if self.requested is not None and round > 0:
+            received = dict()
+            for download in history.downloads[round-1]:
+                if download.piece in self.requested:
+                    received[download.piece] = received.get(download.piece, 0) + download.blocks
+            self.wasted += sum(max(0, blocks - self.requested[piece]) for piece, blocks in received.items())
+            self.requested = None
+
+        if needed is not None:
+            return needed.remaining
+        return sum(blocks_per_piece - pieces[piece] for piece in bits(needed_mask))
+
+    def requests(self, peers, needed_mask, rarity, pieces, blocks_per_piece, rates, rng=random, needed=None):
+        """
+        peers -- the peers to request from
+        needed_mask -- bitset of the pieces we still need
+        rarity -- RarityIndex, already updated with peers
+        pieces -- blocks held of each piece (a client's self.pieces)
+        blocks_per_piece -- blocks in a complete piece
+        rates -- dict of peer id -> observed blocks per round from that peer
+        rng -- source of randomness for breaking ties
+        needed -- NeededMask at needed_mask, to reuse its set of pieces
+
+        returns: list of (peer id, piece) pairs
+        """
+        needed = needed.needed if needed is not None else set(bits(needed_mask))
+        order = list(rarity.ordered(rng, needed))
+        self.requested = {piece: blocks_per_piece - pieces[piece] for piece in order}
+
+        # fastest uploaders first; each starts at a different point of the order
+        # so that the first blocks sent by different peers differ
+        fastest = sorted(peers, key=lambda peer: rates.get(peer.id, 0), reverse=True)
+        plan = []
+        for i, peer in enumerate(fastest):
+            has = rarity.peer_pieces[peer.id]
+            start = i % len(order) if order else 0
+            plan += [(peer.id, piece) for piece in order[start:] + order[:start] if piece in has]
+
+        self.duplicates += max(0, len(plan) - len(order))
+        return plan
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+import json
+import time
+
+clock = getattr(time, "perf_counter", time.time)
+
+def add(table, key, value):
+    # [samples, total, max] of the values seen for key
+    entry = table.get(key)
+    if entry is None:
+        table[key] = [1, value, value]
+    else:
+        entry[0] += 1
+        entry[1] += value
+        if value > entry[2]:
+            entry[2] = value
+
+class Collector(object):
+    """
+    Timings, sizes and counters reported by clients' probes, summed over
+    every client of the same class.
+
+    Timings are kept per stack, e.g. ("RwTourney", "requests", "rarity"),
+    and each stack's own time excludes its children, so folded() is a
+    flame graph's input as it stands.
+    """
+    def __init__(self):
+        # stack -> [calls, own seconds, most own seconds in one call]
+        self.phases = dict()
+        # (class, method) -> [calls, seconds, most seconds in one call], children included
+        self.calls = dict()
+        # (class, method, name) -> [samples, total, max]
+        self.sizes = dict()
+        # (class, name) -> count
+        self.counters = dict()
+
+    def add_phase(self, stack, seconds):
+        add(self.phases, stack, seconds)
+
+    def add_call(self, key, seconds):
+        add(self.calls, key, seconds)
+
+    def add_size(self, key, n):
+        add(self.sizes, key, n)
+
+    def add_count(self, key, n):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def hit_rates(self):
+        """
+        returns: dict of (class, name) -> hits / (hits + misses), for every
+        pair of counters name_cache_hits and name_cache_misses
+        """
+        rates = dict()
+        for (name, counter), hits in self.counters.items():
+            if counter.endswith("_cache_hits"):
+                key = (name, counter[:-len("_cache_hits")])
+                total = hits + self.counters.get((name, key[1] + "_cache_misses"), 0)
+                rates[key] = hits / float(total) if total else None
+        return rates
+
+    def to_json(self):
+        """
+        returns: dict of calls, phases, sizes, counters and hit rates, keyed by dotted names
+        """
+        return {
+            "calls": dict((".".join(key), {"calls": calls, "total_ms": 1000 * total, "max_ms": 1000 * most,
+                                           "mean_ms": 1000 * total / calls})
+                          for key, (calls, total, most) in self.calls.items()),
+            "phases": dict((".".join(stack), {"calls": calls, "total_ms": 1000 * total, "max_ms": 1000 * most,
+                                              "mean_ms": 1000 * total / calls})
+                           for stack, (calls, total, most) in self.phases.items()),
+            "sizes": dict((".".join(key), {"samples": samples, "mean": total / float(samples), "max": most})
+                          for key, (samples, total, most) in self.sizes.items()),
+            "counters": dict((".".join(key), count) for key, count in self.counters.items()),
+            "hit_rates": dict((".".join(key), rate) for key, rate in self.hit_rates().items()),
+        }
+
+    def folded(self):
+        """
+        returns: lines of "class;method;phase microseconds", the folded stack
+        format flamegraph.pl, speedscope and inferno read
+        """
+        return ["%s %d" % (";".join(stack), round(1e6 * total))
+                for stack, (_, total, _) in sorted(self.phases.items())]
+
+    def save(self, json_path=None, folded_path=None):
+        if json_path:
+            with open(json_path, "w") as f:
+                json.dump(self.to_json(), f, indent=2, sort_keys=True)
+        if folded_path:
+            with open(folded_path, "w") as f:
+                f.write("\n".join(self.folded()) + "\n")
+
+class Probe(object):
+    """
+    One client's view of a collector. A method is timed from start() to
+    stop(), and each lap(name) charges the time since the previous lap (or
+    start) to a phase of that method; whatever is left at stop() is the
+    method's own time.
+    """
+    on = True
+
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+        self.method = None
+        self.began = None
+        self.last = None
+
+    def start(self, method):
+        self.method = method
+        self.began = self.last = clock()
+
+    def lap(self, phase):
+        now = clock()
+        self.collector.add_phase((self.name, self.method, phase), now - self.last)
+        self.last = now
+
+    def stop(self):
+        now = clock()
+        self.collector.add_phase((self.name, self.method), now - self.last)
+        self.collector.add_call((self.name, self.method), now - self.began)
+        self.method = None
+
+    def size(self, name, n):
+        self.collector.add_size((self.name, self.method, name), n)
+
+    def count(self, name, n=1):
+        self.collector.add_count((self.name, name), n)
+
+class NullProbe(object):
+    """
+    The probe clients get when no collector is installed: every call is a
+    no-op. Sizes that cost something to compute are guarded by `on`.
+    """
+    on = False
+
+    def start(self, method):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def stop(self):
+        pass
+
+    def size(self, name, n):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+NULL_PROBE = NullProbe()
+
+# collector for clients created from now on, None to leave them uninstrumented
+collector = None
+
+def install(new_collector):
+    """
+    new_collector -- Collector that clients created from now on report to,
+    or None to stop instrumenting new clients
+
+    returns: the collector that was installed before
+    """
+    global collector
+    old = collector
+    collector = new_collector
+    return old
+
+def probe(client):
+    """
+    returns: a Probe for the client if a collector is installed, NULL_PROBE otherwise
+    """
+    if collector is None:
+        return NULL_PROBE
+    return Probe(collector, type(client).__name__)
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+import random
+
+from rwbits import bits, mask_of, popcount
+
+class RarityIndex(object):
+    """
+    Piece rarity over the peers a client can see, kept across rounds.
+
+    Each call to update() applies only the pieces that peers gained or lost
+    since the previous call, so the per-round cost follows the amount of
+    change in the swarm rather than its size. A peer whose available_pieces
+    is the same list, at the same length, as at the last update is taken as
+    unchanged without looking at its pieces, since simulators only ever
+    append to those lists in place or replace them.
+    """
+    def __init__(self):
+        # peer id -> set of pieces that peer had at the last update
+        self.peer_pieces = dict()
+        # peer id -> (available_pieces list, its length) at the last update
+        self.lists = dict()
+        # peer id -> the same pieces as an int bitset
+        self.masks = dict()
+        # piece -> set of ids of the peers that have it
+        self.holders = dict()
+        # piece -> number of peers that have it (only pieces with count > 0)
+        self.counts = dict()
+        # count -> set of pieces with exactly that many holders
+        self.buckets = dict()
+
+        # peers that joined or changed, and peers that left, at the last update
+        self.changed = set()
+        self.left = []
+        # peers taken as unchanged from their list alone at the last update
+        self.reused = 0
+
+    def update(self, peers):
+        """
+        peers -- available info about the peers (who has what pieces)
+
+        Brings the index up to date with the current view of the peers. Peers
+        missing from the view are forgotten.
+        """
+        self.changed = set()
+        self.left = []
+        self.reused = 0
+
+        seen = set()
+        for peer in peers:
+            seen.add(peer.id)
+            available = peer.available_pieces
+            last = self.lists.get(peer.id)
+            if last is not None and last[0] is available and last[1] == len(available):
+                self.reused += 1
+                continue
+            self.lists[peer.id] = (available, len(available))
+            pieces = set(available)
+            old_pieces = self.peer_pieces.get(peer.id)
+
+            if old_pieces is None:
+                # peer joined
+                for piece in pieces:
+                    self._shift(piece, peer.id, 1)
+                self.masks[peer.id] = mask_of(pieces)
+                self.changed.add(peer.id)
+            elif pieces != old_pieces:
+                # peer gained or lost pieces
+                for piece in pieces - old_pieces:
+                    self._shift(piece, peer.id, 1)
+                for piece in old_pieces - pieces:
+                    self._shift(piece, peer.id, -1)
+                self.masks[peer.id] ^= mask_of(pieces ^ old_pieces)
+                self.changed.add(peer.id)
+            self.peer_pieces[peer.id] = pieces
+
+        # peers that left
+        if len(seen) != len(self.peer_pieces):
+            self.left = [p for p in self.peer_pieces if p not in seen]
+            for peer_id in self.left:
+                for piece in self.peer_pieces.pop(peer_id):
+                    self._shift(piece, peer_id, -1)
+                del self.masks[peer_id]
+                del self.lists[peer_id]
+
+    def ordered(self, rng=random, needed=None):
+        """
+        rng -- source of randomness for breaking ties
+        needed -- set of the pieces to order, None for every available piece
+
+        returns: RarestOrder of the available pieces in needed, rarest first,
+        with pieces of equal rarity in random order
+        """
+        return RarestOrder(self, needed, rng)
+
+    def _shift(self, piece, peer_id, delta):
+        if delta > 0:
+            self.holders.setdefault(piece, set()).add(peer_id)
+        else:
+            self.holders[piece].discard(peer_id)
+
+        count = self.counts.get(piece, 0)
+        if count:
+            bucket = self.buckets[count]
+            bucket.discard(piece)
+            if not bucket:
+                del self.buckets[count]
+
+        count += delta
+        if count:
+            self.counts[piece] = count
+            self.buckets.setdefault(count, set()).add(piece)
+        else:
+            del self.counts[piece]
+            del self.holders[piece]
+
+class RarestOrder(object):
+    """
+    Pieces of a RarityIndex ordered by rarity, then by a random tie-break,
+    worked out only as far as it is read. Iterating walks the order, and
+    the pieces of each rarity are only shuffled once the walk reaches them,
+    so a round that takes a few of the rarest pieces does not pay for
+    ordering the rest. key() gives any piece's place in the order without
+    walking to it.
+    """
+    def __init__(self, rarity, needed, rng):
+        self.rarity = rarity
+        self.needed = needed
+        self.rng = rng
+        # piece -> (count, tie-break), drawn the first time the piece is looked at
+        self.keys = dict()
+        # counts of the buckets not walked yet, rarest last
+        self.pending = sorted(rarity.buckets, reverse=True)
+        # the order as far as it has been walked
+        self.pieces = []
+
+    def key(self, piece):
+        """
+        returns: (count, tie-break) of an available piece; pieces sort in
+        the order by their keys
+        """
+        key = self.keys.get(piece)
+        if key is None:
+            key = self.keys[piece] = (self.rarity.counts[piece], self.rng.random())
+        return key
+
+    def extend(self):
+        """
+        returns: the pieces of the next bucket, now appended to self.pieces
+        in order
+        """
+        bucket = self.rarity.buckets[self.pending.pop()]
+        if self.needed is not None:
+            bucket = [piece for piece in bucket if piece in self.needed]
+        else:
+            bucket = list(bucket)
+        bucket.sort(key=self.key)
+        self.pieces += bucket
+        return bucket
+
+    def __iter__(self):
+        i = 0
+        while True:
+            while i == len(self.pieces):
+                if not self.pending:
+                    return
+                self.extend()
+            yield self.pieces[i]
+            i += 1
+
+class WantedCounts(object):
+    """
+    Which of the pieces we still need each peer has, and how many, kept
+    across rounds.
+
+    update() must be called after every RarityIndex.update(). Only peers that
+    joined or changed are recounted; pieces we completed are taken off the
+    peers holding them.
+    """
+    def __init__(self):
+        # peer id -> bitset of the needed pieces the peer has
+        self.masks = dict()
+        # peer id -> number of needed pieces the peer has
+        self.counts = dict()
+        self.needed_mask = 0
+
+    def update(self, rarity, needed_mask):
+        """
+        rarity -- RarityIndex, just updated
+        needed_mask -- bitset of the pieces we still need
+        """
+        for peer_id in rarity.left:
+            del self.masks[peer_id]
+            del self.counts[peer_id]
+
+        # pieces we completed no longer count for the peers that have them
+        completed = self.needed_mask & ~needed_mask
+        if completed:
+            for piece in bits(completed):
+                bit = 1 << piece
+                for peer_id in rarity.holders.get(piece, ()):
+                    if peer_id not in rarity.changed:
+                        self.masks[peer_id] ^= bit
+                        self.counts[peer_id] -= 1
+        self.needed_mask = needed_mask
+
+        for peer_id in rarity.changed:
+            mask = self.masks[peer_id] = needed_mask & rarity.masks[peer_id]
+            self.counts[peer_id] = popcount(mask)
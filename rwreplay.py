@@ -0,0 +1,385 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import struct
+import timeit
+
+import rwsim
+
+MAGIC = b"RWR1"
+
+# record types; every record is a type byte, a varint payload length and the payload
+NAME = 1        # a peer id, given the next index
+PIECES = 2      # update_pieces(): changed (index gap, blocks) pairs
+REQUESTS = 3    # requests() call: peers, then history delta
+UPLOADS = 4     # uploads() call: incoming requests, peers, then history delta
+MADE_REQUESTS = 5   # what requests() returned
+MADE_UPLOADS = 6    # what uploads() returned
+RNG = 7         # the client's RNG state, as JSON
+
+# how a peer's available_pieces changed since it was last written
+SAME, APPENDED, REPLACED = 0, 1, 2
+
+def put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+class Reader(object):
+    """
+    Cursor over one record's payload.
+    """
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.pos = 0
+
+    def varint(self):
+        n = shift = 0
+        while True:
+            b = self.data[self.pos]
+            self.pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def double(self):
+        value = struct.unpack_from("<d", bytes(self.data[self.pos:self.pos + 8]))[0]
+        self.pos += 8
+        return value
+
+def rng_state(rng):
+    # JSON has no tuples, so the state is rebuilt with them in load_rng_state()
+    version, internal, gauss = rng.getstate()
+    return [version, list(internal), gauss]
+
+def load_rng_state(rng, state):
+    rng.setstate((state[0], tuple(state[1]), state[2]))
+
+class Recorder(object):
+    """
+    Stands in for a client and writes everything it is given, and everything
+    it returns, to a binary log that Replay can feed to a fresh client with
+    no simulator. Wrap the client once any state overrides are applied.
+    A client sharing a batched simulator's rarity index cannot be recorded,
+    since on replay it indexes rarity itself and breaks ties differently.
+
+    Payloads are varints, delta-encoded against what the log already holds:
+    peer ids are written once and then referred to by index, a peer's
+    available_pieces only by what was appended since it was last written,
+    pieces by the entries that changed, and history by the rounds added.
+    The client's RNG state is written before its first call and, with
+    rng_every, every rng_every rounds after that.
+    """
+    def __init__(self, client, path, rng_every=0):
+        if getattr(client, "swarm", None) is not None:
+            raise ValueError("%s shares a batched simulator's rarity index and cannot be replayed" % client.id)
+        self.client = client
+        self.out = open(path, "wb")
+        self.out.write(MAGIC)
+        self.rng_every = rng_every
+        self.last_rng = 0
+
+        # peer id -> index in the log
+        self.names = dict()
+        # peer id -> available_pieces as last written, and the list it was written from
+        self.available = dict()
+        self.lists = dict()
+        self.pieces = list(client.pieces)
+        self.downloads = 0
+        self.uploads_seen = 0
+
+        header = {
+            "client": "%s.%s" % (type(client).__module__, type(client).__name__),
+            "id": client.id,
+            "up_bw": client.up_bw,
+            "pieces": self.pieces,
+            "conf": vars(client.conf),
+            "state": getattr(client, "state", None),
+        }
+        self._write_raw(json.dumps(header, sort_keys=True).encode("utf-8"))
+        self._write_rng()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def update_pieces(self, new_pieces):
+        payload = bytearray()
+        last = 0
+        for i, blocks in enumerate(new_pieces):
+            if blocks != self.pieces[i]:
+                put_varint(payload, i - last)
+                put_varint(payload, blocks)
+                last = i
+        self._write(PIECES, payload)
+        self.pieces = list(new_pieces)
+        self.client.update_pieces(new_pieces)
+
+    def requests(self, peers, history):
+        self._checkpoint(history)
+        payload = bytearray()
+        self._put_peers(payload, peers)
+        self._put_history(payload, history)
+        self._write(REQUESTS, payload)
+
+        made = self.client.requests(peers, history)
+
+        payload = bytearray()
+        put_varint(payload, len(made))
+        for r in made:
+            put_varint(payload, self._name(r.peer_id))
+            put_varint(payload, r.piece_id)
+            put_varint(payload, r.start)
+        self._write(MADE_REQUESTS, payload)
+        return made
+
+    def uploads(self, requests, peers, history):
+        self._checkpoint(history)
+        payload = bytearray()
+        put_varint(payload, len(requests))
+        for r in requests:
+            put_varint(payload, self._name(r.requester_id))
+            put_varint(payload, r.piece_id)
+            put_varint(payload, r.start)
+        self._put_peers(payload, peers)
+        self._put_history(payload, history)
+        self._write(UPLOADS, payload)
+
+        made = self.client.uploads(requests, peers, history)
+
+        payload = bytearray()
+        put_varint(payload, len(made))
+        for u in made:
+            put_varint(payload, self._name(u.to_id))
+            payload += struct.pack("<d", u.bw)
+        self._write(MADE_UPLOADS, payload)
+        return made
+
+    def close(self):
+        self.out.close()
+
+    def _checkpoint(self, history):
+        round = history.current_round()
+        if self.rng_every and round % self.rng_every == 0 and round != self.last_rng:
+            self._write_rng()
+            self.last_rng = round
+
+    def _write_rng(self):
+        if hasattr(self.client, "rng"):
+            self._write(RNG, json.dumps(rng_state(self.client.rng)).encode("utf-8"))
+
+    def _name(self, peer_id):
+        index = self.names.get(peer_id)
+        if index is None:
+            index = self.names[peer_id] = len(self.names)
+            self._write(NAME, peer_id.encode("utf-8"))
+        return index
+
+    def _put_peers(self, payload, peers):
+        put_varint(payload, len(peers))
+        for peer in peers:
+            put_varint(payload, self._name(peer.id))
+            old = self.available.get(peer.id)
+            new = peer.available_pieces
+            # lists are only ever appended to in place, so the same list at the same length is unchanged
+            if old is not None and len(old) == len(new) and (new is self.lists[peer.id] or old == new):
+                put_varint(payload, SAME)
+                continue
+            if old is not None and len(new) > len(old) and new[:len(old)] == old:
+                put_varint(payload, APPENDED)
+                added = new[len(old):]
+            else:
+                put_varint(payload, REPLACED)
+                added = new
+            put_varint(payload, len(added))
+            for piece in added:
+                put_varint(payload, piece)
+            self.available[peer.id] = list(new)
+            self.lists[peer.id] = new
+
+    def _put_history(self, payload, history):
+        # rounds of downloads and of uploads added since the last call
+        new_downloads = history.downloads[self.downloads:]
+        put_varint(payload, len(new_downloads))
+        for downloads in new_downloads:
+            put_varint(payload, len(downloads))
+            for d in downloads:
+                put_varint(payload, self._name(d.from_id))
+                put_varint(payload, d.piece)
+                put_varint(payload, d.blocks)
+        self.downloads += len(new_downloads)
+
+        new_uploads = history.uploads[self.uploads_seen:]
+        put_varint(payload, len(new_uploads))
+        for uploads in new_uploads:
+            put_varint(payload, len(uploads))
+            for u in uploads:
+                put_varint(payload, self._name(u.to_id))
+                payload += struct.pack("<d", u.bw)
+        self.uploads_seen += len(new_uploads)
+
+    def _write(self, kind, payload):
+        self.out.write(struct.pack("B", kind))
+        self._write_raw(payload)
+
+    def _write_raw(self, payload):
+        length = bytearray()
+        put_varint(length, len(payload))
+        self.out.write(bytes(length))
+        self.out.write(bytes(payload))
+
+def read_records(f):
+    """
+    f -- log file opened for reading in binary
+
+    returns: iterator over (type, payload) records after the header
+    """
+    while True:
+        kind = f.read(1)
+        if not kind:
+            return
+        yield bytearray(kind)[0], read_raw(f)
+
+def read_raw(f):
+    n = shift = 0
+    while True:
+        b = bytearray(f.read(1))[0]
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            break
+        shift += 7
+    return f.read(n)
+
+class Replay(object):
+    """
+    A client's recorded log, fed back into a client with no simulator.
+    The inputs of every call are rebuilt exactly as they were recorded, so
+    any client class can be run on the same workload, and with compare its
+    outputs are checked against the recorded ones.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            assert f.read(len(MAGIC)) == MAGIC, "%s is not a replay log" % path
+            self.header = json.loads(read_raw(f).decode("utf-8"))
+
+    def client(self, path=None):
+        """
+        path -- "module.Class" of the client to replay into, default the recorded one
+
+        returns: a new client in the recorded client's starting state
+        """
+        cls = rwsim.load_client(path or self.header["client"])
+        conf = rwsim.SimConfig()
+        conf.__dict__.update(self.header["conf"])
+        client = cls(conf, self.header["id"], self.header["pieces"], self.header["up_bw"])
+        if self.header["state"] is not None:
+            client.state.update(self.header["state"])
+        return client
+
+    def run(self, client, compare=False, timings=None):
+        """
+        client -- client to feed the log to, from client()
+        compare -- check the client's outputs against the recorded ones
+        timings -- dict of method -> list, to append each call's seconds to
+
+        returns: number of calls whose output differed from the recording,
+        or 0 without compare
+        """
+        names = []
+        available = dict()
+        history = rwsim.AgentHistory(client.id, [], [])
+        made = None
+        mismatches = 0
+        clock = timeit.default_timer
+
+        with open(self.path, "rb") as f:
+            f.read(len(MAGIC))
+            read_raw(f)
+            for kind, payload in read_records(f):
+                r = Reader(payload)
+                if kind == NAME:
+                    names.append(payload.decode("utf-8"))
+                elif kind == RNG:
+                    load_rng_state(client.rng, json.loads(payload.decode("utf-8")))
+                elif kind == PIECES:
+                    pieces = list(client.pieces)
+                    i = 0
+                    while r.pos < len(r.data):
+                        i += r.varint()
+                        pieces[i] = r.varint()
+                    client.update_pieces(pieces)
+                elif kind == REQUESTS:
+                    peers = self._peers(r, names, available)
+                    self._history(r, names, history)
+                    began = clock()
+                    made = client.requests(peers, history)
+                    if timings is not None:
+                        timings.setdefault("requests", []).append(clock() - began)
+                elif kind == UPLOADS:
+                    requests = [rwsim.Request(names[r.varint()], client.id, r.varint(), r.varint())
+                                for _ in range(r.varint())]
+                    peers = self._peers(r, names, available)
+                    self._history(r, names, history)
+                    began = clock()
+                    made = client.uploads(requests, peers, history)
+                    if timings is not None:
+                        timings.setdefault("uploads", []).append(clock() - began)
+                elif kind == MADE_REQUESTS:
+                    if compare:
+                        recorded = [(names[r.varint()], r.varint(), r.varint()) for _ in range(r.varint())]
+                        if recorded != [(m.peer_id, m.piece_id, m.start) for m in made]:
+                            mismatches += 1
+                elif kind == MADE_UPLOADS:
+                    if compare:
+                        recorded = [(names[r.varint()], r.double()) for _ in range(r.varint())]
+                        if recorded != [(m.to_id, float(m.bw)) for m in made]:
+                            mismatches += 1
+        return mismatches
+
+    def _peers(self, r, names, available):
+        peers = []
+        for _ in range(r.varint()):
+            peer_id = names[r.varint()]
+            change = r.varint()
+            if change != SAME:
+                added = [r.varint() for _ in range(r.varint())]
+                available[peer_id] = available[peer_id] + added if change == APPENDED else added
+            peers.append(rwsim.PeerInfo(peer_id, available[peer_id]))
+        return peers
+
+    def _history(self, r, names, history):
+        for _ in range(r.varint()):
+            history.downloads.append([rwsim.Download(names[r.varint()], history.peer_id, r.varint(), r.varint())
+                                      for _ in range(r.varint())])
+        for _ in range(r.varint()):
+            history.uploads.append([rwsim.Upload(history.peer_id, names[r.varint()], r.double())
+                                    for _ in range(r.varint())])
+
+def main():
+    parser = argparse.ArgumentParser(description="Feed recorded client inputs back into a client.")
+    parser.add_argument("logs", nargs="+", help="logs written by rwsim.py --record")
+    parser.add_argument("--client", help="module.Class to replay into, default the recorded client")
+    parser.add_argument("--compare", action="store_true", help="check outputs against the recording")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    for path in args.logs:
+        replay = Replay(path)
+        timings = dict()
+        mismatches = 0
+        for _ in range(args.repeat):
+            mismatches += replay.run(replay.client(args.client), args.compare, timings)
+        line = "%s (%s):" % (path, args.client or replay.header["client"])
+        for method in sorted(timings):
+            times = sorted(timings[method])
+            line += " %s median %.3f ms, total %.1f ms;" % (
+                method, 1000 * times[len(times) // 2], 1000 * sum(times))
+        if args.compare:
+            line += " %d calls differ" % mismatches
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/python
+
+import random
+
+def client_rng(conf, peer_id):
+    """
+    conf -- the simulation config a client was created with
+    peer_id -- the client's id
+
+    returns: the client's source of randomness
+
+    When the config carries a seed, each client gets its own random.Random
+    derived from that seed and its id, so a run is reproducible no matter how
+    many runs share the process. Otherwise clients share the random module.
+    """
+    seed = getattr(conf, "seed", None)
+    if seed is None:
+        return random
+    return random.Random("%s/%s" % (seed, peer_id))
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import multiprocessing
+
+import rwsim
+
+def parse_mix(spec):
+    """
+    spec -- "module.Class:count,...", e.g. "rwstd.RwStd:10,rwtourney.RwTourney:10"
+
+    returns: list of (module.Class, count) pairs
+    """
+    mix = []
+    for part in spec.split(","):
+        path, _, count = part.strip().partition(":")
+        mix.append((path, int(count or 1)))
+    return mix
+
+def tournament(mixes, configs, seeds, states=None, seed_classes=None, seed_states=None):
+    """
+    mixes -- list of client mixes, as parse_mix() returns them
+    configs -- list of dicts of SimConfig arguments
+    seeds -- list of swarm seeds
+    states -- list of dicts of client class name -> overrides for its self.state
+    seed_classes -- list of "module.Class" of the initial seeds, None for rwsim.Seed
+    seed_states -- list of dicts of overrides for the initial seeds' self.state only
+
+    returns: list of run specs, one per (mix, seed class, config, state, seed state, seed)
+    """
+    return [{"mix": mix, "seed_class": seed_class, "conf": conf, "seed": seed, "state": state,
+             "seed_state": seed_state}
+            for mix in mixes for seed_class in seed_classes or [None] for conf in configs
+            for state in states or [{}] for seed_state in seed_states or [{}] for seed in seeds]
+
+def run_one(spec):
+    """
+    spec -- run spec, as tournament() makes them
+
+    returns: dict with the spec and, for each client class, the round each
+    of its peers completed (None if it never did) and the blocks each
+    uploaded and downloaded
+
+    Every client in the swarm draws from its own RNG stream, seeded from the
+    spec's seed and the client's id, so a run gives the same result in any
+    worker process.
+    """
+    conf = dict(spec["conf"])
+    conf["seed"] = spec["seed"]
+    agents = [(rwsim.load_client(path), count) for path, count in spec["mix"]]
+    seed_class = rwsim.load_client(spec["seed_class"]) if spec.get("seed_class") else rwsim.Seed
+    sim = rwsim.Simulation(rwsim.SimConfig(**conf), agents, seed_class, spec.get("state"),
+                           seed_state=spec.get("seed_state"))
+    results = sim.run()
+
+    # the leechers only, even when the seeds are of one of their classes
+    strategies = dict()
+    for peer_id in sorted(sim.ids[sim.conf.num_seeds:]):
+        name = results["classes"][peer_id]
+        s = strategies.setdefault(name, {"completed": [], "uploaded": [], "downloaded": []})
+        s["completed"].append(results["completed"][peer_id])
+        s["uploaded"].append(results["uploaded"][peer_id])
+        s["downloaded"].append(int(sim.blocks[sim.index[peer_id]].sum()))
+
+    return {"spec": spec, "rounds": results["rounds"], "wasted": results["wasted"], "strategies": strategies}
+
+def run(specs, workers=None):
+    """
+    specs -- run specs, as tournament() makes them
+    workers -- processes to run them in, None for one per core
+
+    returns: iterator over run_one() results, in the order runs finish
+    """
+    if workers == 1:
+        for spec in specs:
+            yield run_one(spec)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(run_one, specs):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def mix_label(mix, seed_class=None):
+    label = ",".join(["%s:%d" % (path, count) for path, count in mix])
+    if seed_class:
+        label += " seeded by %s" % seed_class
+    return label
+
+def config_label(conf, state=None, seed_state=None):
+    label = json.dumps(conf, sort_keys=True)
+    if state:
+        label += " state %s" % json.dumps(state, sort_keys=True)
+    if seed_state:
+        label += " seed state %s" % json.dumps(seed_state, sort_keys=True)
+    return label
+
+class Table(object):
+    """
+    Per-strategy totals over runs, one row for each (mix, config and state, strategy),
+    added to as results stream in.
+    """
+    def __init__(self):
+        # (mix, config, strategy) -> totals
+        self.rows = dict()
+
+    def add(self, result):
+        mix = mix_label(result["spec"]["mix"], result["spec"].get("seed_class"))
+        conf = config_label(result["spec"]["conf"], result["spec"].get("state"), result["spec"].get("seed_state"))
+        for name, s in result["strategies"].items():
+            row = self.rows.setdefault((mix, conf, name), {"runs": 0, "peers": 0, "completed": [], "uploaded": 0,
+                                                           "downloaded": 0, "swarm_rounds": 0, "wasted": 0})
+            row["runs"] += 1
+            row["swarm_rounds"] += result["rounds"]
+            row["wasted"] += result["wasted"]
+            row["peers"] += len(s["completed"])
+            row["completed"] += [r for r in s["completed"] if r is not None]
+            row["uploaded"] += sum(s["uploaded"])
+            row["downloaded"] += sum(s.get("downloaded", []))
+
+    def summary(self):
+        """
+        returns: list of dicts, one per row: runs, fraction of peers that
+        completed, median, 99th percentile and mean completion round, mean
+        blocks uploaded per peer, blocks downloaded per block uploaded, and
+        per run, mean rounds until the whole swarm completed (or max_round)
+        and mean blocks the swarm wasted
+        """
+        summary = []
+        for (mix, conf, name), row in sorted(self.rows.items()):
+            completed = sorted(row["completed"])
+            summary.append({
+                "mix": mix,
+                "config": conf,
+                "strategy": name,
+                "runs": row["runs"],
+                "completed": len(completed) / float(row["peers"]),
+                "median_round": completed[len(completed) // 2] if completed else None,
+                "p99_round": completed[min(len(completed) - 1, int(0.99 * len(completed)))] if completed else None,
+                "mean_round": sum(completed) / float(len(completed)) if completed else None,
+                "mean_uploaded": row["uploaded"] / float(row["peers"]),
+                "down_per_up": row["downloaded"] / float(row["uploaded"]) if row["uploaded"] else None,
+                "swarm_rounds": row["swarm_rounds"] / float(row["runs"]),
+                "wasted": row["wasted"] / float(row["runs"]),
+            })
+        return summary
+
+    def format(self):
+        lines = ["%-12s %5s %6s %7s %7s %7s %7s %9s %7s %8s  %s" % (
+            "strategy", "runs", "done", "median", "p99", "mean", "swarm", "uploaded", "down/up", "wasted",
+            "mix / config")]
+        for r in self.summary():
+            lines.append("%-12s %5d %5.0f%% %7s %7s %7s %7.1f %9.1f %7s %8.1f  %s %s" % (
+                r["strategy"], r["runs"], 100 * r["completed"],
+                "-" if r["median_round"] is None else r["median_round"],
+                "-" if r["p99_round"] is None else r["p99_round"],
+                "-" if r["mean_round"] is None else "%.1f" % r["mean_round"],
+                r["swarm_rounds"], r["mean_uploaded"],
+                "-" if r["down_per_up"] is None else "%.3f" % r["down_per_up"],
+                r["wasted"], r["mix"], r["config"]))
+        return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run swarms for every client mix, config and seed over a process pool.")
+    parser.add_argument("--mix", action="append", required=True,
+                        help="module.Class:count,..., e.g. rwstd.RwStd:10,rwtourney.RwTourney:10; repeatable")
+    parser.add_argument("--config", action="append",
+                        help='JSON of SimConfig arguments, e.g. {"min_up_bw": 4, "max_up_bw": 8}; repeatable')
+    parser.add_argument("--state", action="append",
+                        help='JSON of client class name -> self.state overrides, e.g. {"RwStd": {"auto_slots": true}}; '
+                             'repeatable')
+    parser.add_argument("--seeds", type=int, default=10, help="runs per mix, config and state, seeded 0 to seeds - 1")
+    parser.add_argument("--seed-class", action="append",
+                        help="module.Class of the initial seeds, e.g. rwseed.RwSeed; repeatable, default rwsim.Seed")
+    parser.add_argument("--seed-state", action="append",
+                        help='JSON of self.state overrides for the initial seeds only, e.g. {"seed_mode": "super"}; '
+                             'repeatable')
+    parser.add_argument("--workers", type=int, default=None, help="processes, default one per core")
+    parser.add_argument("--out", help="file to stream each run's results to, as JSON lines")
+    args = parser.parse_args()
+
+    mixes = [parse_mix(spec) for spec in args.mix]
+    configs = [json.loads(conf) for conf in args.config or ["{}"]]
+    states = [json.loads(state) for state in args.state or ["{}"]]
+    seed_states = [json.loads(state) for state in args.seed_state or ["{}"]]
+    specs = tournament(mixes, configs, list(range(args.seeds)), states, args.seed_class, seed_states)
+
+    table = Table()
+    out = open(args.out, "w") if args.out else None
+    try:
+        for i, result in enumerate(run(specs, args.workers)):
+            table.add(result)
+            if out:
+                out.write(json.dumps(result, sort_keys=True) + "\n")
+                out.flush()
+            print("%d/%d runs done" % (i + 1, len(specs)))
+    finally:
+        if out:
+            out.close()
+
+    print(table.format())
+
+if __name__ == "__main__":
+    main()
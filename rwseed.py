@@ -0,0 +1,14 @@
+#!/usr/bin/python
+
+from rwengine import Engine
+
+class RwSeed(Engine):
+    """
+    An initial seed that uploads in piece-sized slots (seed_mode "super");
+    pass it to rwsim or rwrunner as the seed class.
+    """
+    def post_init(self):
+        Engine.post_init(self)
+        self.state["seed_mode"] = "super"
+
+        self.unchoker = self.seed_unchoker
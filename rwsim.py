@@ -0,0 +1,534 @@
+#!/usr/bin/python
+
+import argparse
+from array import array
+import importlib
+import json
+import os
+import random
+import sys
+import types
+
+import numpy as np
+
+import rwprobe
+import rwreplay
+from rwrarity import RarityIndex
+from rwrng import client_rng
+
+class Request(object):
+    def __init__(self, requester_id, peer_id, piece_id, start):
+        self.requester_id = requester_id
+        self.peer_id = peer_id
+        self.piece_id = piece_id
+        self.start = start
+
+class Upload(object):
+    def __init__(self, from_id, to_id, up_bw):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.bw = up_bw
+
+class Download(object):
+    def __init__(self, from_id, to_id, piece, blocks):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.piece = piece
+        self.blocks = blocks
+
+class PeerInfo(object):
+    """
+    What a client can see of another peer: its id and completed pieces.
+    """
+    def __init__(self, id, available_pieces):
+        self.id = id
+        self.available_pieces = available_pieces
+
+class AgentHistory(object):
+    """
+    What one peer has seen so far. downloads[i] and uploads[i] list the
+    Download and Upload objects to and from the peer in round i.
+    """
+    def __init__(self, peer_id, downloads, uploads):
+        self.peer_id = peer_id
+        self.downloads = downloads
+        self.uploads = uploads
+
+    def current_round(self):
+        return len(self.downloads)
+
+class KeptRounds(object):
+    """
+    The last `window` rounds of one kind of message, packed into arrays.
+    Indexed and sliced like the list it stands in for, counting every round
+    ever appended, but reading a round older than the window raises
+    IndexError.
+    """
+    def __init__(self, window, pack, unpack):
+        self.window = window
+        self.pack = pack
+        self.unpack = unpack
+        self.rounds = 0
+        self.ring = [None] * window
+        # (round, messages) last read, since a client reads the same round several times
+        self.last = (None, None)
+
+    def __len__(self):
+        return self.rounds
+
+    def append(self, messages):
+        self.ring[self.rounds % self.window] = self.pack(messages)
+        self.rounds += 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[r] for r in range(*i.indices(self.rounds))]
+        if i < 0:
+            i += self.rounds
+        if not max(0, self.rounds - self.window) <= i < self.rounds:
+            raise IndexError("round %d is not among the last %d kept" % (i, self.window))
+        if self.last[0] != i:
+            self.last = (i, self.unpack(self.ring[i % self.window]))
+        return self.last[1]
+
+    def __iter__(self):
+        # the kept rounds only
+        for r in range(max(0, self.rounds - self.window), self.rounds):
+            yield self[r]
+
+class BoundedHistory(object):
+    """
+    An AgentHistory that keeps only the last `window` rounds, so memory
+    stays flat however long the swarm runs. Each round is stored as arrays
+    of peer indexes, pieces, blocks and bandwidths, and turned back into
+    Download and Upload objects when read. Blocks downloaded from and
+    bandwidth uploaded to each peer over the whole run are kept as counters.
+    """
+    def __init__(self, peer_id, window):
+        """
+        peer_id -- the peer whose history this is
+        window -- rounds to keep, at least the client's history_window
+        """
+        assert window > 0, "window must be positive"
+        self.peer_id = peer_id
+        # peer index -> peer id, and back
+        self.ids = []
+        self.index = dict()
+        # peer index -> blocks downloaded from it / bandwidth uploaded to it, over every round
+        self.downloaded = array("l")
+        self.uploaded = array("d")
+        self.downloads = KeptRounds(window, self._pack_downloads, self._unpack_downloads)
+        self.uploads = KeptRounds(window, self._pack_uploads, self._unpack_uploads)
+
+    def current_round(self):
+        return len(self.downloads)
+
+    def downloaded_from(self, peer_id):
+        """
+        returns: blocks downloaded from peer_id over every round
+        """
+        i = self.index.get(peer_id)
+        return 0 if i is None else self.downloaded[i]
+
+    def uploaded_to(self, peer_id):
+        """
+        returns: bandwidth uploaded to peer_id over every round
+        """
+        i = self.index.get(peer_id)
+        return 0 if i is None else self.uploaded[i]
+
+    def _peer(self, peer_id):
+        i = self.index.get(peer_id)
+        if i is None:
+            i = self.index[peer_id] = len(self.ids)
+            self.ids.append(peer_id)
+            self.downloaded.append(0)
+            self.uploaded.append(0)
+        return i
+
+    def _pack_downloads(self, downloads):
+        peers, pieces, blocks = array("l"), array("l"), array("l")
+        for d in downloads:
+            i = self._peer(d.from_id)
+            peers.append(i)
+            pieces.append(d.piece)
+            blocks.append(d.blocks)
+            self.downloaded[i] += d.blocks
+        return peers, pieces, blocks
+
+    def _unpack_downloads(self, packed):
+        ids = self.ids
+        return [Download(ids[i], self.peer_id, piece, blocks) for i, piece, blocks in zip(*packed)]
+
+    def _pack_uploads(self, uploads):
+        # bandwidths come back as floats
+        peers, bws = array("l"), array("d")
+        for u in uploads:
+            i = self._peer(u.to_id)
+            peers.append(i)
+            bws.append(u.bw)
+            self.uploaded[i] += u.bw
+        return peers, bws
+
+    def _unpack_uploads(self, packed):
+        ids = self.ids
+        return [Upload(self.peer_id, ids[i], bw) for i, bw in zip(*packed)]
+
+def even_split(n, k):
+    """
+    n -- amount to split
+    k -- number of parts
+
+    returns: k integers that sum to n and differ by at most one
+    """
+    if k == 0:
+        return []
+    j, r = divmod(n, k)
+    return [j + 1] * r + [j] * (k - r)
+
+class Peer(object):
+    def __init__(self, config, id, init_pieces, up_bandwidth):
+        self.conf = config
+        self.id = id
+        self.pieces = init_pieces[:]
+        # bandwidth in blocks per round
+        self.up_bw = up_bandwidth
+        # no peer can upload more than this many pieces' worth of requests in one round
+        self.max_requests = self.conf.max_up_bw // self.conf.blocks_per_piece + 1
+        self.max_requests = min(self.max_requests, self.conf.num_pieces)
+        self.post_init()
+
+    def post_init(self):
+        pass
+
+    def update_pieces(self, new_pieces):
+        self.pieces = new_pieces[:]
+
+    def requests(self, peers, history):
+        return []
+
+    def uploads(self, requests, peers, history):
+        return []
+
+class Seed(Peer):
+    """
+    A peer that starts with every piece and splits its bandwidth evenly
+    among up to four random requesters.
+    """
+    def post_init(self):
+        self.rng = client_rng(self.conf, self.id)
+        # reads no history
+        self.history_window = 1
+
+    def uploads(self, requests, peers, history):
+        request_ids = sorted(set([request.requester_id for request in requests]))
+        chosen = self.rng.sample(request_ids, min(4, len(request_ids)))
+        bws = even_split(self.up_bw, len(chosen))
+        return [Upload(self.id, peer_id, bw) for (peer_id, bw) in zip(chosen, bws)]
+
+def install():
+    """
+    Makes the classes above importable as the peer, messages, util and
+    history modules that the clients import, for each of those modules that
+    is not already on the path. Call before importing a client module.
+    """
+    interfaces = {
+        "peer": {"Peer": Peer},
+        "messages": {"Request": Request, "Upload": Upload, "Download": Download, "PeerInfo": PeerInfo},
+        "util": {"even_split": even_split},
+        "history": {"AgentHistory": AgentHistory, "BoundedHistory": BoundedHistory},
+    }
+    for name, attrs in interfaces.items():
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            module = types.ModuleType(name)
+            module.__dict__.update(attrs)
+            sys.modules[name] = module
+
+def load_client(path):
+    """
+    path -- "module.Class", e.g. "rwtourney.RwTourney"
+
+    returns: the client class
+    """
+    install()
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+class SimConfig(object):
+    def __init__(self, num_pieces=128, blocks_per_piece=16, min_up_bw=16, max_up_bw=64,
+                 max_round=1000, num_seeds=1, neighbors=None, seed=0):
+        self.num_pieces = num_pieces
+        self.blocks_per_piece = blocks_per_piece
+        self.min_up_bw = min_up_bw
+        self.max_up_bw = max_up_bw
+        self.max_round = max_round
+        self.num_seeds = num_seeds
+        # roughly how many random peers each peer sees, None for all of them
+        self.neighbors = neighbors
+        self.seed = seed
+
+class Simulation(object):
+    """
+    A swarm of clients sharing one file, run round by round in-process.
+
+    Client decisions are plain method calls, but piece state lives in one
+    peers x pieces array and each round's transfers are resolved for the
+    whole swarm at once with NumPy.
+
+    Batched, when every peer sees the whole swarm, the swarm's pieces are
+    indexed once a round and the index is shared with every client that
+    takes it (see Engine.share_view), instead of each client indexing the
+    same view of its own.
+    """
+    def __init__(self, conf, agents, seed_class=Seed, state=None, batched=False, seed_state=None):
+        """
+        conf -- SimConfig
+        agents -- list of (client class, count) pairs for the leechers
+        seed_class -- client class of the conf.num_seeds initial seeds
+        state -- dict of client class name -> overrides for its self.state
+        batched -- share one rarity index over the swarm between the clients,
+        if conf.neighbors is None; their tie-breaking then differs from an
+        index of their own, so rwreplay cannot replay them
+        seed_state -- overrides for the initial seeds' self.state only,
+        applied after state
+        """
+        self.conf = conf
+        self.rng = random.Random(conf.seed)
+        random.seed(conf.seed)
+
+        classes = [seed_class] * conf.num_seeds
+        for cls, count in agents:
+            classes += [cls] * count
+        n = len(classes)
+        bpp = conf.blocks_per_piece
+
+        dtype = np.uint8 if bpp < 256 else np.uint16
+        self.blocks = np.zeros((n, conf.num_pieces), dtype=dtype)
+        self.blocks[:conf.num_seeds] = bpp
+        self.up_bw = [self.rng.randint(conf.min_up_bw, conf.max_up_bw) for _ in range(n)]
+
+        self.ids = ["%s%d" % (cls.__name__, i) for i, cls in enumerate(classes)]
+        self.index = {peer_id: i for i, peer_id in enumerate(self.ids)}
+        self.classes = [cls.__name__ for cls in classes]
+        self.agents = []
+        for i, cls in enumerate(classes):
+            agent = cls(conf, self.ids[i], self.blocks[i].tolist(), self.up_bw[i])
+            if state and cls.__name__ in state:
+                agent.state.update(state[cls.__name__])
+            if seed_state and i < conf.num_seeds:
+                agent.state.update(seed_state)
+            self.agents.append(agent)
+
+        # rarity index over every peer, shared with the clients when batched
+        self.swarm = None
+        if batched and conf.neighbors is None:
+            self.swarm = RarityIndex()
+            for agent in self.agents:
+                if hasattr(agent, "share_view"):
+                    agent.share_view(self.swarm)
+
+        # completed pieces of each peer, as the lists handed to clients
+        self.available = [list(range(conf.num_pieces)) if i < conf.num_seeds else [] for i in range(n)]
+        # clients that say how many rounds back they read get a history that keeps only those
+        self.histories = [AgentHistory(peer_id, [], []) if getattr(agent, "history_window", None) is None
+                          else BoundedHistory(peer_id, agent.history_window)
+                          for peer_id, agent in zip(self.ids, self.agents)]
+        if conf.neighbors is None:
+            self.neighbors = None
+        else:
+            # connections go both ways, each peer opening half of its share
+            k = min(max(conf.neighbors // 2, 1), n - 1)
+            links = [set() for _ in range(n)]
+            for i in range(n):
+                opened = set()
+                while len(opened) < k:
+                    j = self.rng.randrange(n)
+                    if j != i:
+                        opened.add(j)
+                for j in opened:
+                    links[i].add(j)
+                    links[j].add(i)
+            self.neighbors = [sorted(link) for link in links]
+
+        self.round = 0
+        self.completed = [0 if i < conf.num_seeds else None for i in range(n)]
+        self.uploaded = np.zeros(n, dtype=np.int64)
+        self.wasted = 0
+
+    def run(self):
+        """
+        returns: results(), once every peer has the file or max_round passes
+        """
+        while self.round < self.conf.max_round and None in self.completed:
+            self.step()
+        return self.results()
+
+    def step(self):
+        n = len(self.agents)
+        infos = [PeerInfo(self.ids[i], self.available[i]) for i in range(n)]
+        if self.swarm is not None:
+            self.swarm.update(infos)
+
+        requests = []
+        incoming = [[] for _ in range(n)]
+        for i, agent in enumerate(self.agents):
+            made = agent.requests(self._view(i, infos), self.histories[i])
+            for request in made:
+                incoming[self.index[request.peer_id]].append(request)
+            requests += made
+
+        uploads = []
+        for i, agent in enumerate(self.agents):
+            made = agent.uploads(incoming[i], self._view(i, infos), self.histories[i])
+            total = sum([upload.bw for upload in made])
+            if total > self.up_bw[i] + 1e-6:
+                raise ValueError("%s uploaded %s blocks with bandwidth %s" % (self.ids[i], total, self.up_bw[i]))
+            self.histories[i].uploads.append(made)
+            uploads += made
+
+        self._transfer(requests, uploads)
+        self.round += 1
+
+    def results(self):
+        return {
+            "rounds": self.round,
+            "completed": dict(zip(self.ids, self.completed)),
+            "uploaded": dict(zip(self.ids, self.uploaded.tolist())),
+            "classes": dict(zip(self.ids, self.classes)),
+            "wasted": self.wasted,
+        }
+
+    def _view(self, i, infos):
+        # a fresh list each time, since clients shuffle it in place
+        if self.neighbors is None:
+            return infos[:i] + infos[i+1:]
+        return [infos[j] for j in self.neighbors[i]]
+
+    def _transfer(self, requests, uploads):
+        n, num_pieces = self.blocks.shape
+        bpp = self.conf.blocks_per_piece
+        downloads = [[] for _ in range(n)]
+
+        if requests and uploads:
+            # bandwidth each peer gives each requester, summed per (requester, uploader) pair
+            up_keys = np.array([self.index[u.to_id] * n + self.index[u.from_id] for u in uploads], dtype=np.int64)
+            up_bws = np.array([u.bw for u in uploads], dtype=float)
+            pair_keys, pair_index = np.unique(up_keys, return_inverse=True)
+            pair_bws = np.floor(np.bincount(pair_index, weights=up_bws)).astype(np.int64)
+
+            # requests grouped by pair, keeping the order each requester made them in
+            requester = np.array([self.index[r.requester_id] for r in requests], dtype=np.int64)
+            target = np.array([self.index[r.peer_id] for r in requests], dtype=np.int64)
+            piece = np.array([r.piece_id for r in requests], dtype=np.int64)
+            start = np.array([r.start for r in requests], dtype=np.int64)
+            keys = requester * n + target
+            order = np.argsort(keys, kind="mergesort")
+            keys, requester, target, piece = keys[order], requester[order], target[order], piece[order]
+            need = np.clip(bpp - start[order], 0, bpp)
+
+            # only pieces the uploader actually has can be sent
+            need[self.blocks[target, piece] < bpp] = 0
+
+            slot = np.minimum(np.searchsorted(pair_keys, keys), len(pair_keys) - 1)
+            bw = np.where(pair_keys[slot] == keys, pair_bws[slot], 0)
+
+            # each pair's bandwidth fills its requests in order
+            cum_need = np.cumsum(need)
+            group_start = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+            group = np.cumsum(np.r_[1, np.diff(keys) != 0]) - 1
+            before = cum_need - need - (cum_need - need)[group_start][group]
+            got = np.clip(bw - before, 0, need)
+
+            sent = got > 0
+            requester, target, piece, got = requester[sent], target[sent], piece[sent], got[sent]
+            self.uploaded += np.bincount(target, weights=got, minlength=n).astype(np.int64)
+
+            # apply to the requesters, anything past a full piece is wasted
+            cells, cell_index = np.unique(requester * num_pieces + piece, return_inverse=True)
+            flat = self.blocks.reshape(-1)
+            old = flat[cells].astype(np.int64)
+            new = np.minimum(old + np.bincount(cell_index, weights=got).astype(np.int64), bpp)
+            flat[cells] = new
+            self.wasted += int(got.sum() - (new - old).sum())
+
+            for i, j, p, b in zip(requester.tolist(), target.tolist(), piece.tolist(), got.tolist()):
+                downloads[i].append(Download(self.ids[j], self.ids[i], p, b))
+
+            # newly completed pieces become visible next round
+            done = (new == bpp) & (old < bpp)
+            for cell in cells[done].tolist():
+                i, p = divmod(cell, num_pieces)
+                self.available[i] = self.available[i] + [p]
+
+            for i in np.unique(requester).tolist():
+                self.agents[i].update_pieces(self.blocks[i].tolist())
+                if self.completed[i] is None and len(self.available[i]) == num_pieces:
+                    self.completed[i] = self.round + 1
+
+        for i in range(n):
+            self.histories[i].downloads.append(downloads[i])
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a swarm of clients in-process.")
+    parser.add_argument("clients", nargs="+", help="module.Class:count, e.g. rwtourney.RwTourney:100")
+    parser.add_argument("--pieces", type=int, default=128)
+    parser.add_argument("--blocks-per-piece", type=int, default=16)
+    parser.add_argument("--min-bw", type=int, default=16)
+    parser.add_argument("--max-bw", type=int, default=64)
+    parser.add_argument("--max-round", type=int, default=1000)
+    parser.add_argument("--seeds", type=int, default=1)
+    parser.add_argument("--seed-class", help="module.Class of the initial seeds, e.g. rwseed.RwSeed")
+    parser.add_argument("--neighbors", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--state", help='JSON of client class name -> self.state overrides, e.g. {"RwStd": {"auto_slots": true}}')
+    parser.add_argument("--seed-state", help='JSON of self.state overrides for the initial seeds only, e.g. {"seed_mode": "super"}')
+    parser.add_argument("--batched", action="store_true",
+                        help="without --neighbors, index the swarm's pieces once a round for all clients instead of once per client")
+    parser.add_argument("--probe-json", help="save the clients' phase timings, sizes and counters as JSON")
+    parser.add_argument("--probe-folded", help="save the clients' phase timings as folded stacks, for flame graphs")
+    parser.add_argument("--record", help="directory to write each leecher's inputs and outputs to, for rwreplay.py")
+    args = parser.parse_args()
+    if args.record and args.batched:
+        parser.error("--record cannot be used with --batched: replayed clients index rarity themselves")
+
+    collector = None
+    if args.probe_json or args.probe_folded:
+        collector = rwprobe.Collector()
+        rwprobe.install(collector)
+
+    agents = []
+    for spec in args.clients:
+        path, _, count = spec.partition(":")
+        agents.append((load_client(path), int(count or 1)))
+    conf = SimConfig(args.pieces, args.blocks_per_piece, args.min_bw, args.max_bw,
+                     args.max_round, args.seeds, args.neighbors, args.seed)
+    seed_class = load_client(args.seed_class) if args.seed_class else Seed
+    state = json.loads(args.state) if args.state else None
+    seed_state = json.loads(args.seed_state) if args.seed_state else None
+    sim = Simulation(conf, agents, seed_class, state, batched=args.batched, seed_state=seed_state)
+    recorders = []
+    if args.record:
+        if not os.path.isdir(args.record):
+            os.makedirs(args.record)
+        for i in range(conf.num_seeds, len(sim.agents)):
+            recorder = rwreplay.Recorder(sim.agents[i], os.path.join(args.record, "%s.rwr" % sim.ids[i]))
+            sim.agents[i] = recorder
+            recorders.append(recorder)
+    results = sim.run()
+    for recorder in recorders:
+        recorder.close()
+    if collector is not None:
+        collector.save(args.probe_json, args.probe_folded)
+
+    print("rounds: %d, wasted blocks: %d" % (results["rounds"], results["wasted"]))
+    for name in sorted(set(results["classes"].values())):
+        ids = [i for i, cls in results["classes"].items() if cls == name]
+        rounds = sorted([results["completed"][i] for i in ids if results["completed"][i] is not None])
+        median = rounds[len(rounds) // 2] if rounds else None
+        uploaded = sum([results["uploaded"][i] for i in ids]) / float(len(ids))
+        print("%s: %d/%d complete, median round %s, mean blocks uploaded %.1f" % (name, len(rounds), len(ids), median, uploaded))
+
+if __name__ == "__main__":
+    main()
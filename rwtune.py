@@ -0,0 +1,210 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import random
+
+import rwrunner
+import rwsim
+
+# knobs each client keeps in self.state, as (low, high) for a range or a list of choices;
+# ranges of ints are sampled as ints
+SPACES = {
+    "rwstd.RwStd": {
+        "num_slots": (1, 10),
+    },
+    "rwpropshare.RwPropShare": {
+        "frac_random_bw": (0.0, 0.5),
+    },
+    "rwtyrant.RwTyrant": {
+        "gamma": (0.0, 0.3),
+        "alpha": (0.0, 0.5),
+        "r": (1, 10),
+    },
+    "rwtourney.RwTourney": {
+        "frac_random_bw": (0.0, 0.5),
+        "history_discount": (0.5, 1.0),
+        "len_history": (1, 10),
+        "request_count_factor": (0.0, 2.0),
+    },
+}
+
+# swarms to tune in; "others" is the rest of the mix next to the tuned client
+PROFILES = {
+    "homogeneous": {"count": 20, "others": [], "conf": {"num_pieces": 64}},
+    "mixed": {"count": 5, "conf": {"num_pieces": 64},
+              "others": [("rwstd.RwStd", 5), ("rwpropshare.RwPropShare", 5),
+                         ("rwtyrant.RwTyrant", 5), ("rwtourney.RwTourney", 5)]},
+    "slow": {"count": 20, "others": [], "conf": {"num_pieces": 64, "min_up_bw": 8, "max_up_bw": 24}},
+}
+
+def sample(space, rng):
+    """
+    space -- dict of knob -> (low, high) or list of choices
+
+    returns: dict of knob -> a random value
+    """
+    params = dict()
+    for name, values in sorted(space.items()):
+        if isinstance(values, list):
+            params[name] = rng.choice(values)
+        elif isinstance(values[0], int) and isinstance(values[1], int):
+            params[name] = rng.randint(values[0], values[1])
+        else:
+            # rounded so that values read well and repeat between runs of the tuner
+            params[name] = round(rng.uniform(values[0], values[1]), 3)
+    return params
+
+class Cache(object):
+    """
+    Scores of (client, profile, params, seed) runs already made, kept in a
+    JSON lines file so a re-run of the tuner only simulates what is new. The
+    key holds the whole profile, so editing a profile does not reuse its old
+    scores.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.scores = dict()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.scores[entry["key"]] = entry["score"]
+
+    @staticmethod
+    def key(path, profile, params, seed):
+        return json.dumps([path, profile, params, seed], sort_keys=True)
+
+    def get(self, key):
+        return self.scores.get(key)
+
+    def put(self, key, score):
+        self.scores[key] = score
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "score": score}, sort_keys=True) + "\n")
+
+def spec(path, profile, params, seed):
+    """
+    returns: the rwrunner run spec for one run of the client with params in the profile's swarm
+    """
+    name = path.rsplit(".", 1)[1]
+    count = profile["count"] + sum([c for p, c in profile["others"] if p == path])
+    mix = [(path, count)] + [(p, c) for p, c in profile["others"] if p != path]
+    return {"mix": mix, "conf": profile["conf"], "seed": seed, "state": {name: params}}
+
+def score(result, path):
+    """
+    returns: mean completion round of the client's peers in a run, counting
+    peers that never completed as finishing on the last round
+    """
+    completed = result["strategies"][path.rsplit(".", 1)[1]]["completed"]
+    return sum([result["rounds"] if r is None else r for r in completed]) / float(len(completed))
+
+class Tuner(object):
+    """
+    Successive halving over randomly sampled configs of one client in one
+    swarm profile: every config is scored on a few seeds, the best 1/eta are
+    kept and scored on eta times as many, until one is left or the seed
+    budget runs out. Lower scores are better. Every (config, seed) run is
+    cached, and each stage's runs go to the process pool together.
+    """
+    def __init__(self, path, profile, cache, workers=None):
+        """
+        path -- "module.Class" of the client to tune
+        profile -- swarm to tune it in, as in PROFILES
+        cache -- Cache of runs already scored
+        workers -- processes to run in, None for one per core
+        """
+        self.path = path
+        self.profile = profile
+        self.cache = cache
+        self.workers = workers
+        # (cached, simulated) runs
+        self.runs = [0, 0]
+
+    def evaluate(self, candidates, seeds):
+        """
+        candidates -- list of param dicts
+        seeds -- how many seeds to score each on
+
+        returns: list of mean scores, one per candidate
+        """
+        keys = dict()
+        specs = []
+        for params in candidates:
+            for seed in range(seeds):
+                key = Cache.key(self.path, self.profile, params, seed)
+                if self.cache.get(key) is None and key not in keys:
+                    keys[key] = True
+                    specs.append(spec(self.path, self.profile, params, seed))
+                else:
+                    self.runs[0] += 1
+
+        name = self.path.rsplit(".", 1)[1]
+        for result in rwrunner.run(specs, self.workers):
+            params = result["spec"]["state"][name]
+            self.cache.put(Cache.key(self.path, self.profile, params, result["spec"]["seed"]), score(result, self.path))
+            self.runs[1] += 1
+
+        return [sum([self.cache.get(Cache.key(self.path, self.profile, params, seed)) for seed in range(seeds)]) / float(seeds)
+                for params in candidates]
+
+    def tune(self, candidates, min_seeds=2, max_seeds=16, eta=2):
+        """
+        candidates -- list of param dicts to choose between
+
+        returns: (best params, its mean score, seeds it was scored on)
+        """
+        seeds = min_seeds
+        while True:
+            scores = self.evaluate(candidates, seeds)
+            ranked = sorted(range(len(candidates)), key=lambda i: scores[i])
+            if len(candidates) == 1 or seeds * eta > max_seeds:
+                best = ranked[0]
+                return candidates[best], scores[best], seeds
+            candidates = [candidates[i] for i in ranked[:max(1, len(candidates) // eta)]]
+            seeds *= eta
+
+def defaults(path):
+    """
+    returns: the client's current values of the knobs in its search space
+    """
+    cls = rwsim.load_client(path)
+    client = cls(rwsim.SimConfig(), "default", [0], 1)
+    return dict((name, client.state[name]) for name in SPACES[path])
+
+def main():
+    parser = argparse.ArgumentParser(description="Search each client's state knobs over simulated swarms.")
+    parser.add_argument("--clients", nargs="+", default=sorted(SPACES))
+    parser.add_argument("--profiles", nargs="+", default=sorted(PROFILES))
+    parser.add_argument("--samples", type=int, default=16, help="random configs per client and profile, besides the defaults")
+    parser.add_argument("--min-seeds", type=int, default=2)
+    parser.add_argument("--max-seeds", type=int, default=16)
+    parser.add_argument("--eta", type=int, default=2, help="keep the best 1/eta configs at each stage")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default one per core")
+    parser.add_argument("--seed", type=int, default=0, help="seed for sampling configs")
+    parser.add_argument("--cache", default="rwtune.cache", help="JSON lines file of runs already scored")
+    parser.add_argument("--out", default="rwtune.json", help="where to save the best configs")
+    args = parser.parse_args()
+
+    cache = Cache(args.cache)
+    best = []
+    for path in args.clients:
+        for profile in args.profiles:
+            rng = random.Random("%s/%s/%s" % (args.seed, path, profile))
+            candidates = [defaults(path)] + [sample(SPACES[path], rng) for _ in range(args.samples)]
+            tuner = Tuner(path, PROFILES[profile], cache, args.workers)
+            params, mean, seeds = tuner.tune(candidates, args.min_seeds, args.max_seeds, args.eta)
+            default = tuner.evaluate([candidates[0]], seeds)[0]
+            best.append({"client": path, "profile": profile, "params": params, "score": mean,
+                         "default_score": default, "seeds": seeds})
+            print("%s in %s: %s, mean round %.1f over %d seeds (defaults %.1f); %d runs cached, %d simulated" % (
+                path, profile, json.dumps(params, sort_keys=True), mean, seeds, default, tuner.runs[0], tuner.runs[1]))
+
+    with open(args.out, "w") as f:
+        json.dump(best, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+#!/usr/bin/python
+
+from array import array
+import heapq
+import logging
+import math
+
+from util import even_split
+from rwhistory import RollingDownloads
+
+class ReciprocalSlots(object):
+    """
+    RwStd's unchoker: num_slots - 1 slots for the requesters that uploaded
+    the most to us last round, an optimistic slot that moves every third
+    round, and random requesters for any slots left, with bandwidth split
+    evenly. With auto_slots, num_slots is hill-climbed every slot_period
+    rounds on the download rate it gets.
+    """
+    def __init__(self):
+        # what the slot controller has seen this period, and its last decision
+        self.prev_unchoked = []
+        self.period_blocks = 0
+        self.period_unchoked = 0
+        self.period_reciprocated = 0
+        self.last_rate = None
+        self.last_slots = None
+
+    def unchoke(self, client, requests, peers, history):
+        """
+        returns: (list of peer ids, list of their bandwidths)
+        """
+        state = client.state
+        probe = client.probe
+        if state["auto_slots"]:
+            self._tune_slots(state, history)
+        probe.lap("slots")
+
+        chosen = []
+        bws = []
+
+        if len(requests) != 0:
+            round = history.current_round()
+
+            # first, the reciprocal unchoking slots
+            last_downloads = history.downloads[round-1] if round != 0 else []
+            request_ids = [request.requester_id for request in requests]
+
+            if last_downloads:
+                # filter to only those who want to download, then sort by previous upload bandwith
+                requesters = set(request_ids)
+                last_id_blocks = [(download.from_id, download.blocks) for download in last_downloads
+                                  if download.from_id in requesters]
+                last_id_blocks.sort(key=lambda download: download[1], reverse=True)
+                last_id = [id for (id, _) in last_id_blocks]
+
+                # select at most top three peers
+                chosen += last_id[:(state["num_slots"] - 1)]
+            probe.lap("history")
+
+            # next, the optimistic unchoking slot
+            if (round % 3) == 0 or state["optimistic_unchoke"] is None:
+                # every third round, unchoke new agent
+                unchosen_requests = [p for p in request_ids if p not in chosen]
+                if unchosen_requests:
+                    opt_peer = client.rng.choice(unchosen_requests)
+                    chosen += [opt_peer]
+                    state["optimistic_unchoke"] = opt_peer
+                else:
+                    unchosen_peers = [p for p in peers if p.id not in chosen]
+                    if unchosen_peers:
+                        opt_peer = client.rng.choice(unchosen_peers).id
+                        chosen += [opt_peer]
+                        state["optimistic_unchoke"] = opt_peer
+            else:
+                # unchoke agent optimistically unchoked previously
+                if state["optimistic_unchoke"]:
+                    chosen += [state["optimistic_unchoke"]]
+
+            # now try to fill in remaining slots randomly if history is insufficient
+            unchosen_requests = [r for r in request_ids if r not in chosen]
+            randomly_chosen = client.rng.sample(unchosen_requests, max(min(len(unchosen_requests), state["num_slots"] - len(chosen)), 0))
+            chosen += randomly_chosen
+
+            # evenly split upload bandwidth among the chosen peeres
+            bws = even_split(client.up_bw, len(chosen))
+            probe.lap("unchoke")
+
+        self.prev_unchoked = chosen
+        return chosen, bws
+
+    def _tune_slots(self, state, history):
+        round = history.current_round()
+        if round == 0:
+            return
+
+        # download rate, and how many of the peers we unchoked reciprocated
+        last_downloads = history.downloads[round-1]
+        uploaders = set([download.from_id for download in last_downloads if download.blocks > 0])
+        self.period_blocks += sum([download.blocks for download in last_downloads])
+        self.period_unchoked += len(self.prev_unchoked)
+        self.period_reciprocated += len([p for p in self.prev_unchoked if p in uploaders])
+        if round % state["slot_period"] != 0:
+            return
+
+        rate = self.period_blocks / float(state["slot_period"])
+        slots = state["num_slots"]
+        if self.last_rate is not None and slots != self.last_slots:
+            # keep moving while the marginal download per added slot says it pays
+            marginal = (rate - self.last_rate) / (slots - self.last_slots)
+            step = 1 if marginal > 0 else -1
+        else:
+            # nothing to compare against yet, so grow if most unchoked peers reciprocate
+            reciprocated = self.period_reciprocated / float(max(self.period_unchoked, 1))
+            step = 1 if reciprocated >= 0.5 else -1
+
+        self.last_rate = rate
+        self.last_slots = slots
+        state["num_slots"] = min(max(slots + step, state["min_slots"]), state["max_slots"])
+
+        self.period_blocks = 0
+        self.period_unchoked = 0
+        self.period_reciprocated = 0
+
+class ProportionalShare(object):
+    """
+    RwPropShare's and RwTourney's unchoker: 1 - frac_random_bw of the
+    bandwidth is split among requesters in proportion to what each uploaded
+    to us over the last len_history rounds, discounted by history_discount
+    per round of age, and frac_random_bw goes to one other requester. That
+    one is picked uniformly, or if weighted, in proportion to one plus the
+    number of pieces it has that we need.
+    """
+    def __init__(self, weighted=False):
+        self.weighted = weighted
+        # built on first use so that len_history and history_discount can be changed after post_init
+        self.rolling = None
+
+    def unchoke(self, client, requests, peers, history):
+        """
+        returns: (list of peer ids, list of their bandwidths)
+        """
+        state = client.state
+        probe = client.probe
+        rng = client.rng
+
+        # fold last round's downloads into the discounted totals
+        if self.rolling is None:
+            self.rolling = RollingDownloads(state["len_history"], state["history_discount"])
+        self.rolling.update(history)
+        probe.lap("history")
+
+        chosen = []
+        bws = []
+
+        if len(requests) != 0:
+            request_ids = sorted(set([request.requester_id for request in requests]))
+
+            # chosen_bw maps peer to proportion of upload bandwidth to receive
+            chosen_bw = dict()
+
+            # first, the proportional unchoking slots, from total discounted downloads
+            # (combined if multiple downloads from same peer), filtered to only those who want to download
+            last_id_blocks = {peer: self.rolling.blocks(peer) for peer in request_ids if peer in self.rolling}
+
+            if last_id_blocks:
+                total_upload_bw = float(sum(last_id_blocks.values()))
+                for from_id, blocks in last_id_blocks.items():
+                    chosen_bw[from_id] = (1 - state["frac_random_bw"]) * (blocks / total_upload_bw)
+
+            if not chosen_bw:
+                # there are no previous round downloads to reference, or the previous uploaders
+                # don't want to download, so allocate to a single peer randomly
+                chosen_bw[rng.choice(request_ids)] = 1 - state["frac_random_bw"]
+
+            # next, the random upload
+            unchosen_requests = [p for p in request_ids if p not in chosen_bw]
+
+            if unchosen_requests and self.weighted:
+                # prefer to choose randomly among the unchosen peers, weighting by how many pieces peer has that I want
+                client.ensure_view(peers, history)
+                unchosen = set(unchosen_requests)
+                counts = client.wanted.counts
+                weights = [(peer.id, counts.get(peer.id, 0) + 1) for peer in peers if peer.id in unchosen]
+                x = rng.randrange(sum([weight for _, weight in weights]))
+                for peer_id, weight in weights:
+                    if x < weight:
+                        break
+                    x -= weight
+                chosen_bw[peer_id] = state["frac_random_bw"]
+            elif unchosen_requests:
+                # prefer to choose randomly among the unchosen peers
+                chosen_bw[rng.choice(unchosen_requests)] = state["frac_random_bw"]
+            else:
+                # otherwise, choose randomly a peer to give more bandwidth
+                chosen_bw[rng.choice(request_ids)] += state["frac_random_bw"]
+
+            # total share of bandwidth should sum to 1
+            tolerance = 0.0001
+            assert abs(sum(chosen_bw.values()) - 1) < tolerance, "total proportion of upload bandwidth is not 1"
+
+            # split bw as calculated
+            chosen = list(chosen_bw.keys())
+            bws = [bw * client.up_bw for bw in chosen_bw.values()]
+
+            # fix floating point imprecision
+            if sum(bws) > client.up_bw:
+                small_decrement = 0.0000001
+                bws = [max(0, bw - small_decrement) for bw in bws]
+            probe.lap("allocate")
+
+        return chosen, bws
+
+class TyrantUnchoke(object):
+    """
+    RwTyrant's unchoker: requesters are unchoked best return on investment
+    first, expected download rate f over the upload tau needed to be
+    reciprocated, until their taus fill state["cap"]. tau grows by alpha for
+    peers that did not reciprocate and shrinks by gamma for peers that have
+    for r rounds running. In adaptive mode f is a cautious EWMA estimate,
+    peers stop being added once their marginal return drops too low, and
+    state["cap"] is hill-climbed every cap_period rounds on the download per
+    uploaded block it gets. Either way the estimator state is reported in
+    state["estimator"] every round.
+    """
+    def __init__(self):
+        self.rolling = RollingDownloads(1)
+
+        # per-peer state lives in arrays, at the slot given by self.index
+        self.index = dict()
+        self.f = array("d")
+        self.tau = array("d")
+        # consecutive rounds the peer has unchoked us, up to last_unchoked
+        self.streak = array("l")
+        # last round the peer unchoked us
+        self.last_unchoked = array("l")
+        # EWMA mean and variance of blocks per round from the peer while we unchoke it
+        self.rate_mean = array("d")
+        self.rate_var = array("d")
+        self.rate_samples = array("l")
+        self.prev_unchoked = []
+        self.prev_bws = []
+
+        # what the cap controller has seen this period, and its last decision
+        self.period_download = 0
+        self.period_upload = 0
+        self.last_roi = None
+        self.cap_step = -1
+
+    def unchoke(self, client, requests, peers, history):
+        """
+        returns: (list of peer ids, list of their bandwidths)
+        """
+        state = client.state
+        probe = client.probe
+        round = history.current_round()
+
+        # fold last round's downloads into the per-peer totals
+        self.rolling.update(history)
+        probe.lap("history")
+
+        if round != 0:
+            # count consecutive rounds each peer has unchoked us
+            unchoked = [peer_id for peer_id, blocks in self.rolling.items() if blocks > 0]
+            for peer_id in unchoked:
+                i = self._slot(client, peer_id)
+                if self.last_unchoked[i] == round - 2:
+                    self.streak[i] += 1
+                else:
+                    self.streak[i] = 1
+                self.last_unchoked[i] = round - 1
+
+            # if necessary, update f and tau from previous round
+            for peer_id in self.prev_unchoked:
+                i = self.index[peer_id]
+                if self.last_unchoked[i] != round - 1:
+                    # choked, increase tau
+                    self.tau[i] = (1 + state["alpha"]) * self.tau[i]
+                else:
+                    # unchoked, f is observed rate
+                    self.f[i] = self.rolling.blocks(peer_id)
+                    if self.streak[i] >= state["r"]:
+                        # chronically unchoked, decrease tau
+                        self.tau[i] = (1 - state["gamma"]) * self.tau[i]
+
+                if state["adaptive"]:
+                    self._observe(state, i, self.rolling.blocks(peer_id))
+
+            if state["adaptive"]:
+                self._tune_cap(client, round)
+            probe.lap("estimates")
+
+        # now select uploads for this round
+        chosen = []
+        bws = []
+        if len(requests) != 0:
+            # return on investment of each requester, best first with random ties
+            request_ids = sorted(set([request.requester_id for request in requests]))
+            ratios = []
+            for peer_id in request_ids:
+                i = self._slot(client, peer_id)
+                ratios.append((-self._expected_rate(state, i) / self.tau[i], client.rng.random(), peer_id))
+            heapq.heapify(ratios)
+
+            # select top peers
+            sum_tau = 0
+            sum_rate = 0
+            while ratios:
+                ratio, _, peer_id = heapq.heappop(ratios)
+                i = self.index[peer_id]
+                tau = self.tau[i]
+                if sum_tau + tau > state["cap"]:
+                    # hit cap
+                    probe.count("cap_hits")
+                    break
+                if state["adaptive"] and chosen and -ratio < state["min_marginal_roi"] * sum_rate / sum_tau:
+                    # peer would pull download per uploaded block down too far
+                    break
+                # room to add peer
+                chosen += [peer_id]
+                bws += [tau]
+                sum_tau += tau
+                sum_rate += self._expected_rate(state, i)
+            probe.lap("unchoke")
+
+        self._report(client, round, chosen, bws)
+
+        self.prev_unchoked = chosen
+        self.prev_bws = bws
+        return chosen, bws
+
+    def _slot(self, client, peer_id):
+        # new peers start with f = 1 and tau = up_bw / 4
+        if peer_id not in self.index:
+            self.index[peer_id] = len(self.f)
+            self.f.append(1)
+            self.tau.append(client.up_bw / float(4))
+            self.streak.append(0)
+            self.last_unchoked.append(-2)
+            self.rate_mean.append(0)
+            self.rate_var.append(0)
+            self.rate_samples.append(0)
+        return self.index[peer_id]
+
+    def _observe(self, state, i, blocks):
+        # exponentially weighted mean and variance of the blocks we got back
+        if not self.rate_samples[i]:
+            self.rate_mean[i] = blocks
+        else:
+            w = state["ewma_weight"]
+            delta = blocks - self.rate_mean[i]
+            self.rate_mean[i] += w * delta
+            self.rate_var[i] = (1 - w) * (self.rate_var[i] + w * delta * delta)
+        self.rate_samples[i] += 1
+
+    def _expected_rate(self, state, i):
+        # in adaptive mode, a cautious estimate once the peer has been observed
+        if not state["adaptive"] or not self.rate_samples[i]:
+            return self.f[i]
+        return max(0, self.rate_mean[i] - state["confidence"] * math.sqrt(self.rate_var[i]))
+
+    def _tune_cap(self, client, round):
+        # download per uploaded block since the last change of cap
+        state = client.state
+        self.period_download += sum(blocks for _, blocks in self.rolling.items())
+        self.period_upload += sum(self.prev_bws)
+        if round % state["cap_period"] != 0 or not self.period_upload:
+            return
+
+        roi = self.period_download / float(self.period_upload)
+        if self.last_roi is not None and roi < self.last_roi:
+            # the last move made things worse, so go back the other way
+            self.cap_step = -self.cap_step
+        self.last_roi = roi
+
+        step = self.cap_step * state["cap_step"] * client.up_bw
+        state["cap"] = min(max(state["cap"] + step, state["min_cap"] * client.up_bw), client.up_bw)
+
+        self.period_download = 0
+        self.period_upload = 0
+
+    def _report(self, client, round, chosen, bws):
+        expected = sum(self._expected_rate(client.state, self.index[peer_id]) for peer_id in chosen)
+        client.state["estimator"] = {
+            "round": round,
+            "active": len(chosen),
+            "cap": client.state["cap"],
+            "committed": sum(bws),
+            "expected_download": expected,
+            "download": sum(blocks for _, blocks in self.rolling.items()),
+            "roi": self.last_roi,
+        }
+        logging.debug("%s estimator: %s", client.id, client.state["estimator"])
+
+class SuperSeed(object):
+    """
+    Unchoker for a client with every piece: a whole piece's worth of
+    bandwidth to each of a few random requesters a round, so what it sends
+    completes quickly and can be passed on. BitTorrent super-seeding also
+    ranks requesters by the rarity of what they ask for and prefers those
+    that passed their last piece on, but in bench/super_seed.sh that did
+    no better than these plain slots.
+    """
+    def unchoke(self, client, requests, peers, history):
+        """
+        returns: (list of peer ids, list of their bandwidths)
+        """
+        if not requests:
+            return [], []
+
+        # by default, one slot per piece of upload bandwidth
+        slots = client.state["seed_slots"] or max(1, int(client.up_bw) // client.conf.blocks_per_piece)
+        requesters = sorted(set(request.requester_id for request in requests))
+        chosen = client.rng.sample(requesters, min(slots, len(requesters)))
+        client.probe.lap("unchoke")
+
+        return chosen, even_split(client.up_bw, len(chosen))
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import unittest
+
+import rwreplay
+import rwsim
+
+# Python 2 and 3 seed and shuffle differently, so each has its own recording
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "equiv", "py%d" % sys.version_info[0])
+
+MIX = ["rwstd.RwStd", "rwpropshare.RwPropShare", "rwtyrant.RwTyrant", "rwtourney.RwTourney"]
+
+# case -> (SimConfig arguments, state overrides); every case runs 2 of each client
+CASES = {
+    "defaults": ({}, {}),
+    "assign_endgame": ({}, dict((path.split(".")[1], {"request_mode": "assign", "endgame_blocks": 40}) for path in MIX)),
+    "adaptive_auto_slots": ({"min_up_bw": 8, "max_up_bw": 30},
+                            {"RwTyrant": {"adaptive": True}, "RwStd": {"auto_slots": True},
+                             "RwTourney": {"endgame_blocks": 30}}),
+    "neighbors": ({"neighbors": 4, "num_pieces": 40}, {}),
+}
+
+def simulation(case, seed=1):
+    conf, state = CASES[case]
+    args = {"num_pieces": 32, "max_round": 300, "seed": seed}
+    args.update(conf)
+    return rwsim.Simulation(rwsim.SimConfig(**args), [(rwsim.load_client(path), 2) for path in MIX], state=state)
+
+def record(out):
+    """
+    out -- directory to write the fixtures to, replacing what is there
+
+    Runs every case, logging each leecher with rwreplay and saving the
+    swarm's results. Re-record only for a change meant to alter behaviour.
+    """
+    if os.path.isdir(out):
+        shutil.rmtree(out)
+    results = dict()
+    for case in sorted(CASES):
+        sim = simulation(case)
+        directory = os.path.join(out, case)
+        os.makedirs(directory)
+        recorders = []
+        for i in range(sim.conf.num_seeds, len(sim.agents)):
+            recorder = rwreplay.Recorder(sim.agents[i], os.path.join(directory, "%s.rwr" % sim.ids[i]))
+            sim.agents[i] = recorder
+            recorders.append(recorder)
+        results[case] = sim.run()
+        for recorder in recorders:
+            recorder.close()
+    with open(os.path.join(out, "results.json"), "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+class EquivalenceTest(unittest.TestCase):
+    """
+    Seeded swarms recorded in fixtures/equiv/pyN must play out the same: every
+    client, fed its recorded inputs, must make the recorded requests and
+    uploads, and each whole swarm must end with the recorded results.
+    """
+    def test_replay(self):
+        for case in sorted(CASES):
+            directory = os.path.join(FIXTURES, case)
+            logs = sorted(name for name in os.listdir(directory) if name.endswith(".rwr"))
+            self.assertTrue(logs, "no logs for %s" % case)
+            for name in logs:
+                replay = rwreplay.Replay(os.path.join(directory, name))
+                mismatches = replay.run(replay.client(), compare=True)
+                self.assertEqual(mismatches, 0, "%s/%s: %d calls differ" % (case, name, mismatches))
+
+    def test_results(self):
+        with open(os.path.join(FIXTURES, "results.json")) as f:
+            recorded = json.load(f)
+        for case in sorted(CASES):
+            results = json.loads(json.dumps(simulation(case).run()))
+            self.assertEqual(results, recorded[case], "%s: swarm results differ" % case)
+
+class BatchedRecordTest(unittest.TestCase):
+    def test_refused(self):
+        sim = rwsim.Simulation(rwsim.SimConfig(num_pieces=8, max_round=10), [(rwsim.load_client(MIX[0]), 2)],
+                               batched=True)
+        path = os.path.join(FIXTURES, "batched.rwr")
+        self.assertRaises(ValueError, rwreplay.Recorder, sim.agents[-1], path)
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seeded equivalence tests of the clients.")
+    parser.add_argument("--record", action="store_true", help="re-record the fixtures instead of testing")
+    args, rest = parser.parse_known_args()
+    if args.record:
+        record(FIXTURES)
+    else:
+        unittest.main(argv=[parser.prog] + rest)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from rwhistory import RollingDownloads
+from rwsim import AgentHistory, Download
+
+class SmallBoostRollingDownloads(RollingDownloads):
+    # rescale every ~130 rounds at discount 0.9 instead of every ~3300
+    max_boost = 1e6
+
+    def __init__(self, window, discount=1.0):
+        RollingDownloads.__init__(self, window, discount)
+        self.rescales = 0
+
+    def _rescale(self):
+        self.rescales += 1
+        RollingDownloads._rescale(self)
+
+def rescan(history, window, discount):
+    """
+    returns: dict of peer id -> discounted blocks over the window, summed
+    from the raw rounds the way the clients did before RollingDownloads
+    """
+    round = history.current_round()
+    start = 0 if window is None else max(0, round - window)
+    totals = dict()
+    for r in range(start, round):
+        weight = discount ** (round - 1 - r)
+        for download in history.downloads[r]:
+            totals[download.from_id] = totals.get(download.from_id, 0) + download.blocks * weight
+    return totals
+
+class RollingDownloadsTest(unittest.TestCase):
+    """
+    The running totals must match a rescan of the raw history every round,
+    with and without a window, through rescales of the shared factor.
+    """
+    rounds = 3000
+
+    def check(self, window, discount, rescales):
+        rng = random.Random(window or 0)
+        peers = ["peer%d" % i for i in range(8)]
+        history = AgentHistory("me", [], [])
+        rolling = SmallBoostRollingDownloads(window, discount)
+        worst = 0.0
+        for round in range(self.rounds):
+            # some rounds nothing arrives, and a peer can send more than one download
+            history.downloads.append([Download(rng.choice(peers), "me", 0, rng.randint(0, 16))
+                                      for _ in range(rng.choice([0, 1, 2, 5]))])
+            history.uploads.append([])
+            # fold in one round at a time, and now and then several at once
+            if round % 7 == 3:
+                continue
+            rolling.update(history)
+            if window is None and round % 10:
+                # rescanning every round ever is quadratic
+                continue
+
+            want = rescan(history, window, discount)
+            self.assertEqual(set(peer for peer in peers if peer in rolling), set(want), "round %d" % round)
+            self.assertEqual(set(peer for peer, _ in rolling.items()), set(want), "round %d" % round)
+            for peer, blocks in want.items():
+                got = rolling.blocks(peer)
+                if blocks:
+                    worst = max(worst, abs(got - blocks) / blocks)
+                else:
+                    self.assertLess(abs(got), 1e-9, "round %d, %s" % (round, peer))
+        self.assertLess(worst, 1e-9)
+        if rescales:
+            self.assertGreater(rolling.rescales, 0)
+
+    def test_window(self):
+        self.check(10, 0.9, True)
+
+    def test_unbounded(self):
+        self.check(None, 0.9, True)
+
+    def test_window_undiscounted(self):
+        self.check(5, 1.0, False)
+
+    def test_unbounded_undiscounted(self):
+        self.check(None, 1.0, False)
+
+if __name__ == "__main__":
+    unittest.main()
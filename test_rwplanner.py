@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+import heapq
+import random
+import unittest
+
+from rwbits import bits, mask_of
+from rwplanner import rarest_first, rarest_first_penalized
+from rwrarity import RarityIndex
+
+class PeerInfo(object):
+    def __init__(self, id, available_pieces):
+        self.id = id
+        self.available_pieces = available_pieces
+
+def reference_rarest_first(peers, needed_mask, rarity, max_requests, rng):
+    # the planner before rwplanner: each peer sorts its own candidates, with a fresh tie-break per peer
+    counts = rarity.counts
+    plan = []
+    for peer in peers:
+        candidates = bits(needed_mask & rarity.masks[peer.id])
+        chosen = heapq.nsmallest(max_requests, candidates, key=lambda piece: (counts[piece], rng.random()))
+        plan += [(peer.id, piece) for piece in chosen]
+    return plan
+
+def reference_penalized(peers, needed_mask, rarity, max_requests, factor, rng):
+    # RwTourney's planner before rwplanner, penalizing pieces by how often they were requested this round
+    counts = rarity.counts
+    requested = dict.fromkeys(counts, 0)
+    plan = []
+    for peer in peers:
+        candidates = bits(needed_mask & rarity.masks[peer.id])
+        key = lambda piece: (counts[piece] + factor * requested[piece], rng.random())
+        for piece in heapq.nsmallest(max_requests, candidates, key=key):
+            requested[piece] += 1
+            plan.append((peer.id, piece))
+    return plan
+
+def chi2_critical(df, z=3.09):
+    # Wilson-Hilferty approximation of the chi-square quantile; z = 3.09 is p = 0.001
+    h = 2.0 / (9 * df)
+    return df * (1 - h + z * h ** 0.5) ** 3
+
+def chi2_two_sample(a, b):
+    """
+    a, b -- dicts of category -> count, from two samples of the same size
+
+    returns: (statistic, degrees of freedom) of the test that both come from
+    one distribution
+    """
+    keys = [k for k in set(a) | set(b) if a.get(k, 0) + b.get(k, 0) > 0]
+    stat = sum((a.get(k, 0) - b.get(k, 0)) ** 2 / float(a.get(k, 0) + b.get(k, 0)) for k in keys)
+    return stat, len(keys) - 1
+
+class RequestDistributionTest(unittest.TestCase):
+    """
+    Each peer's requests from the planners must follow the same distribution
+    as the per-peer shuffle and sort they replaced, over many seeded rounds.
+    """
+    trials = 3000
+    max_requests = 3
+
+    def setUp(self):
+        rng = random.Random(7)
+        num_pieces = 24
+        self.needed = list(range(20))
+        self.needed_mask = mask_of(self.needed)
+        # a few dense peers that have most needed pieces, the rest sparse, so both branches are taken;
+        # few distinct rarity counts, so ties matter
+        sizes = [18, 16, 12, 9, 6, 4, 3, 2, 5, 17]
+        self.peers = [PeerInfo("p%d" % i, sorted(rng.sample(range(num_pieces), size)))
+                      for i, size in enumerate(sizes)]
+        self.rarity = RarityIndex()
+        self.rarity.update(self.peers)
+
+    def branches(self):
+        dense = [p.id for p in self.peers
+                 if self.max_requests * len(self.needed) < len(set(self.needed) & set(p.available_pieces)) ** 2]
+        return dense, [p.id for p in self.peers if p.id not in dense]
+
+    def sample(self, planner):
+        # peer -> piece -> times requested
+        freq = dict((peer.id, dict()) for peer in self.peers)
+        for seed in range(self.trials):
+            rng = random.Random(seed)
+            peers = list(self.peers)
+            rng.shuffle(peers)
+            for peer_id, piece in planner(peers, rng):
+                freq[peer_id][piece] = freq[peer_id].get(piece, 0) + 1
+        return freq
+
+    def check(self, planner, reference):
+        dense, sparse = self.branches()
+        self.assertTrue(dense and sparse, "fixture must cover both the dense and sparse branches")
+
+        got = self.sample(planner)
+        want = self.sample(reference)
+        for peer in self.peers:
+            self.assertEqual(sum(got[peer.id].values()), sum(want[peer.id].values()))
+            stat, df = chi2_two_sample(got[peer.id], want[peer.id])
+            if df > 0:
+                self.assertLess(stat, chi2_critical(df), "%s: chi2 %.1f on %d df" % (peer.id, stat, df))
+
+    def test_rarest_first(self):
+        m = self.max_requests
+        self.check(lambda peers, rng: rarest_first(peers, self.needed_mask, self.rarity, m, rng),
+                   lambda peers, rng: reference_rarest_first(peers, self.needed_mask, self.rarity, m, rng))
+
+    def test_rarest_first_penalized(self):
+        m = self.max_requests
+        factor = 0.9
+        self.check(lambda peers, rng: rarest_first_penalized(peers, self.needed_mask, self.rarity, m, factor, rng),
+                   lambda peers, rng: reference_penalized(peers, self.needed_mask, self.rarity, m, factor, rng))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+import random
+import unittest
+
+from rwsim import AgentHistory, BoundedHistory, Download, Upload
+
+def fields(messages):
+    return [tuple(sorted(vars(m).items())) for m in messages]
+
+class BoundedHistoryTest(unittest.TestCase):
+    """
+    A BoundedHistory fed the same rounds as a full AgentHistory must read
+    the same within its window, refuse rounds it has dropped, and keep
+    per-peer totals over every round.
+    """
+    window = 3
+    rounds = 40
+
+    def setUp(self):
+        self.rng = random.Random(3)
+        self.peers = ["peer%d" % i for i in range(6)]
+
+    def add_round(self, full, bounded):
+        rng = self.rng
+        downloads = [Download(rng.choice(self.peers), "me", rng.randrange(32), rng.randint(1, 16))
+                     for _ in range(rng.choice([0, 1, 3]))]
+        uploads = [Upload("me", rng.choice(self.peers), rng.choice([4, 2.5, 1 / 3.0]))
+                   for _ in range(rng.choice([0, 2]))]
+        for history in (full, bounded):
+            history.downloads.append(downloads)
+            history.uploads.append(uploads)
+
+    def test_window(self):
+        full = AgentHistory("me", [], [])
+        bounded = BoundedHistory("me", self.window)
+        for round in range(1, self.rounds + 1):
+            self.add_round(full, bounded)
+            self.assertEqual(bounded.current_round(), round)
+            self.assertEqual(len(bounded.downloads), round)
+
+            first = max(0, round - self.window)
+            for r in range(first, round):
+                self.assertEqual(fields(bounded.downloads[r]), fields(full.downloads[r]))
+                self.assertEqual(fields(bounded.uploads[r]), fields(full.uploads[r]))
+            self.assertEqual(fields(bounded.downloads[-1]), fields(full.downloads[-1]))
+            self.assertEqual([fields(d) for d in bounded.downloads[first:round]],
+                             [fields(d) for d in full.downloads[first:round]])
+            self.assertEqual([fields(d) for d in bounded.downloads], [fields(d) for d in full.downloads[first:]])
+
+    def test_dropped_rounds(self):
+        full = AgentHistory("me", [], [])
+        bounded = BoundedHistory("me", self.window)
+        for _ in range(self.rounds):
+            self.add_round(full, bounded)
+
+        dropped = self.rounds - self.window - 1
+        for kept in (bounded.downloads, bounded.uploads):
+            self.assertRaises(IndexError, lambda: kept[dropped])
+            self.assertRaises(IndexError, lambda: kept[0])
+            self.assertRaises(IndexError, lambda: kept[-self.window - 1])
+            self.assertRaises(IndexError, lambda: kept[self.rounds])
+            self.assertRaises(IndexError, lambda: kept[dropped:self.rounds])
+            # reading the last kept round before and after does not hide the error
+            kept[self.rounds - 1]
+            self.assertRaises(IndexError, lambda: kept[dropped])
+
+    def test_totals(self):
+        full = AgentHistory("me", [], [])
+        bounded = BoundedHistory("me", self.window)
+        for _ in range(self.rounds):
+            self.add_round(full, bounded)
+
+        for peer in self.peers:
+            downloaded = sum(d.blocks for downloads in full.downloads for d in downloads if d.from_id == peer)
+            uploaded = sum(u.bw for uploads in full.uploads for u in uploads if u.to_id == peer)
+            self.assertEqual(bounded.downloaded_from(peer), downloaded)
+            self.assertAlmostEqual(bounded.uploaded_to(peer), uploaded)
+        self.assertEqual(bounded.downloaded_from("nobody"), 0)
+        self.assertEqual(bounded.uploaded_to("nobody"), 0)
+
+if __name__ == "__main__":
+    unittest.main()